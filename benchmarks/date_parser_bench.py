@@ -0,0 +1,98 @@
+"""Compara a vazão do date_parser com a versão anterior de bot.parse_date_time (dateutil fuzzy).
+
+Uso:
+    python benchmarks/date_parser_bench.py [--repeat 2000]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import date_parser  # noqa: E402
+
+PHRASES = [
+    "amanhã às 15h",
+    "segunda que vem",
+    "depois de amanhã à tarde",
+    "25/12 15:30",
+    "dia 5 às 9",
+    "sexta-feira da semana que vem de manhã",
+    "daqui a 3 dias 10h30",
+    "próxima quarta 14:00",
+    "hoje",
+    "3 da tarde amanhã",
+    "pode ser dia 20/11/2026 às 10:00?",
+    "quinta de manhã",
+]
+
+
+# Versão anterior de bot.replace_common_expressions / bot.parse_date_time, mantida para comparação
+def legacy_replace_common_expressions(user_input):
+    now = datetime.now(date_parser.BRAZIL_TZ)
+    expressões = {
+        "amanhã": (now + timedelta(days=1)).strftime('%d/%m/%Y'),
+        "hoje": now.strftime('%d/%m/%Y'),
+        "daqui a uma semana": (now + timedelta(weeks=1)).strftime('%d/%m/%Y'),
+    }
+    dias_match = re.search(r'daqui a (\d+) dias', user_input)
+    if dias_match:
+        dias = int(dias_match.group(1))
+        nova_data = (now + timedelta(days=dias)).strftime('%d/%m/%Y')
+        user_input = re.sub(r'daqui a \d+ dias', nova_data, user_input)
+    for expressão, data in expressões.items():
+        user_input = user_input.replace(expressão, data)
+    return user_input
+
+
+def legacy_parse_date_time(user_input):
+    from dateutil import parser
+
+    try:
+        user_input = legacy_replace_common_expressions(user_input.lower())
+        user_input = " ".join(user_input.split())
+        parsed_datetime = parser.parse(user_input, dayfirst=True, fuzzy=True)
+        return parsed_datetime.strftime('%Y-%m-%d'), parsed_datetime.strftime('%H:%M:%S')
+    except ValueError:
+        return None, None
+
+
+def measure(name, parse, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for phrase in PHRASES:
+            parse(phrase)
+    elapsed = time.perf_counter() - start
+    calls = repeat * len(PHRASES)
+    print(f"{name:<22} {calls / elapsed:12.0f} chamadas/s  {elapsed / calls * 1e6:8.2f} µs/chamada")
+
+
+def uncached_parse(phrase):
+    date_parser._parse_normalized.cache_clear()
+    return date_parser.parse(phrase)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    for phrase in PHRASES:
+        print(f"{phrase!r:45} -> {date_parser.parse(phrase)}")
+    print()
+
+    measure("date_parser (cache)", date_parser.parse, args.repeat)
+    measure("date_parser (sem cache)", uncached_parse, args.repeat)
+    try:
+        import dateutil  # noqa: F401
+    except ImportError:
+        print("python-dateutil não instalado: versão anterior não medida")
+        return
+    measure("anterior (dateutil)", legacy_parse_date_time, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""Benchmark de ponta a ponta dos handlers do bot, sem Telegram, MySQL nem modelo.
+
+Simula N pacientes enviando mensagens ao mesmo tempo e mede a latência de
+handle_patient_response, handle_reschedule e send_reminders:
+  - Telegram: Bot/Update falsos que registram o horário de cada resposta;
+  - Banco: SQLite temporário (DB_ASYNC_DRIVER = "sqlite") com pacientes e compromissos;
+  - Modelo: generate_text/classify_text substituídos por funções com latência configurável.
+
+Uso:
+    python benchmarks/e2e_bench.py [--patients 200] [--concurrency 50] [--llm-latency 0.05]
+    python benchmarks/e2e_bench.py --save benchmarks/e2e_baseline.json
+    python benchmarks/e2e_bench.py --compare benchmarks/e2e_baseline.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import model  # noqa: E402
+import bot  # noqa: E402
+import db_async  # noqa: E402
+import migrations  # noqa: E402
+from db_async import SQLiteBackend  # noqa: E402
+from reminders import TokenBucket  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+
+# Mensagens de cada paciente simulado: intenção -> frases possíveis
+MESSAGES = {
+    "confirmar": ["Sim, confirmo", "confirmo minha consulta", "pode confirmar, estarei lá"],
+    "remarcar": ["Preciso remarcar", "quero mudar o horário", "dá pra adiar?"],
+    "cancelar": ["quero cancelar", "não vou mais poder ir, pode desmarcar"],
+    "outro": ["qual o endereço da clínica?", "bom dia", "obrigado"],
+}
+RESCHEDULE_PHRASES = ["amanhã às 15h", "depois de amanhã à tarde", "segunda que vem às 10h",
+                      "daqui a 3 dias 9h", "sexta de manhã"]
+DEFAULT_MIX = "confirmar=50,remarcar=25,cancelar=10,outro=15"
+
+FIRST_TELEGRAM_ID = 10_000_000
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeMessage:
+    """Mensagem recebida; reply_text registra o tempo até a primeira resposta."""
+
+    def __init__(self, chat_id, text, recorder):
+        self.chat_id = chat_id
+        self.text = text
+        self.from_user = FakeUser(chat_id)
+        self.recorder = recorder
+
+    async def reply_text(self, text, reply_markup=None):
+        self.recorder.replies += 1
+        if self.recorder.first_reply is None:
+            self.recorder.first_reply = time.perf_counter()
+        return self
+
+
+class FakeUpdate:
+    _ids = itertools.count(1)
+
+    def __init__(self, message):
+        self.update_id = next(self._ids)
+        self.message = message
+        self.effective_chat = message
+
+
+class ReplyRecorder:
+    def __init__(self):
+        self.replies = 0
+        self.first_reply = None
+
+
+class FakeBot:
+    """Bot falso: send_message só registra o envio (latência de rede configurável)."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append((chat_id, time.perf_counter()))
+
+    async def send_chat_action(self, *args, **kwargs):
+        pass
+
+
+class FakeContext:
+    def __init__(self, fake_bot):
+        self.bot = fake_bot
+        self.user_data = {}
+        self.chat_data = {}
+
+
+# Modelo simulado: mesma assinatura de model.generate_text / model.classify_text
+def install_stub_llm(latency, classify_latency):
+    def generate_text(user_prompt, system_prompt=model.SYSTEM_PROMPT):
+        time.sleep(latency)
+        return f"Resposta simulada ({len(user_prompt)} caracteres no prompt)."
+
+    def classify_text(text, labels, instruction):
+        time.sleep(classify_latency)
+        return labels[-1]
+
+    model.generate_text = generate_text
+    model.classify_text = classify_text
+
+
+def seed_database(path, patients, days, rng):
+    """Cria o banco com `patients` pacientes, cada um com uma consulta nos próximos `days` dias."""
+    connection = sqlite3.connect(path)
+    migrations.migrate(connection, "sqlite")
+    today = datetime.now(bot.BRAZIL_TZ).date()
+    hours = list(range(8, 18))
+    slots = [(today + timedelta(days=day), hour) for day in range(1, days + 1) for hour in hours]
+    rng.shuffle(slots)
+    patient_rows = [(f"Paciente {i}", FIRST_TELEGRAM_ID + i) for i in range(patients)]
+    connection.executemany("INSERT INTO patients (name, telegram_id) VALUES (?, ?)", patient_rows)
+    # Quando há mais pacientes do que horários, os excedentes ficam sem consulta
+    appointment_rows = [(i + 1, str(day), f"{hour:02d}:00:00") for i, (day, hour) in enumerate(slots[:patients])]
+    connection.executemany(
+        "INSERT INTO appointments (patient_id, appointment_date, appointment_time) VALUES (?, ?, ?)",
+        appointment_rows)
+    connection.commit()
+    connection.close()
+    return len(appointment_rows)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        if name not in MESSAGES:
+            raise SystemExit(f"Intenção desconhecida no --mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pick(50),
+        "p95_ms": pick(95),
+        "p99_ms": pick(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+async def timed(handler, update, context, samples, ttfr_samples):
+    recorder = update.message.recorder
+    started = time.perf_counter()
+    result = await handler(update, context)
+    samples.append(time.perf_counter() - started)
+    if recorder.first_reply is not None:
+        ttfr_samples.append(recorder.first_reply - started)
+    return result
+
+
+async def simulate_patient(telegram_id, intent, rng, context, semaphore, samples, think_time):
+    async with semaphore:
+        text = rng.choice(MESSAGES[intent])
+        update = FakeUpdate(FakeMessage(telegram_id, text, ReplyRecorder()))
+        state = await timed(bot.handle_patient_response, update, context,
+                            samples["handle_patient_response"], samples["first_reply_patient_response"])
+        if state != bot.NEW_DATE:
+            return 1
+        if think_time:
+            await asyncio.sleep(think_time)
+        update = FakeUpdate(FakeMessage(telegram_id, rng.choice(RESCHEDULE_PHRASES), ReplyRecorder()))
+        await timed(bot.handle_reschedule, update, context,
+                    samples["handle_reschedule"], samples["first_reply_reschedule"])
+        return 2
+
+
+async def run_reminders(context, days):
+    """Envia os lembretes de todas as consultas semeadas, como ReminderScheduler._fire faria."""
+    now = datetime.now(bot.BRAZIL_TZ).replace(tzinfo=None)
+    started = time.perf_counter()
+    deadlines = await db_async.repository.get_reminder_deadlines(now, now + timedelta(days=days + 1))
+    rows = await db_async.repository.get_reminders_by_ids([row[0] for row in deadlines]) or []
+    fetched = time.perf_counter()
+    await bot.send_reminders(context, rows)
+    finished = time.perf_counter()
+    return {
+        "reminders": len(rows),
+        "fetch_ms": (fetched - started) * 1000,
+        "send_ms": (finished - fetched) * 1000,
+        "reminders_per_s": len(rows) / (finished - started) if finished > started else 0.0,
+    }
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    fake_bot = FakeBot(args.send_latency)
+    context = FakeContext(fake_bot)
+    samples = {name: [] for name in ("handle_patient_response", "first_reply_patient_response",
+                                     "handle_reschedule", "first_reply_reschedule")}
+
+    intents = rng.choices(list(mix), weights=list(mix.values()), k=args.patients)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    started = time.perf_counter()
+    messages = await asyncio.gather(*(
+        simulate_patient(FIRST_TELEGRAM_ID + i, intent, rng, context, semaphore, samples, args.think_time)
+        for i, intent in enumerate(intents)))
+    elapsed = time.perf_counter() - started
+
+    reminders = await run_reminders(context, args.days) if not args.skip_reminders else None
+    await bot.close_resources(None)
+
+    results = {
+        "params": {key: value for key, value in vars(args).items() if key not in ("save", "compare")},
+        "handlers": {name: percentiles(values) for name, values in samples.items()},
+        "messages": sum(messages),
+        "elapsed_s": elapsed,
+        "msgs_per_s": sum(messages) / elapsed if elapsed else 0.0,
+        "reminders": reminders,
+        "caches": {
+            "lookups": bot.lookups.stats(),
+            "intent": bot.intent_engine.stats(),
+            "dialogue_sink": bot.dialogue_sink.stats(),
+        },
+    }
+    return results
+
+
+def report(results, baseline=None):
+    print(f"{results['messages']} mensagens em {results['elapsed_s']:.2f}s -> {results['msgs_per_s']:.1f} msgs/s")
+    print(f"{'handler':32} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in results["handlers"].items():
+        if not stats["count"]:
+            continue
+        print(f"{name:32} {stats['count']:6d} {stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} "
+              f"{stats['p99_ms']:9.2f} {stats['max_ms']:9.2f}")
+        if baseline and baseline["handlers"].get(name, {}).get("count"):
+            before = baseline["handlers"][name]
+            deltas = "  ".join(f"{key[:-3]} {change(before[key], stats[key])}"
+                               for key in ("p50_ms", "p95_ms", "p99_ms"))
+            print(f"{'  vs. base':32} {'':6} {deltas}")
+    if baseline:
+        print(f"msgs/s vs. base: {change(baseline['msgs_per_s'], results['msgs_per_s'])}")
+
+    reminders = results["reminders"]
+    if reminders:
+        print(f"lembretes: {reminders['reminders']} (busca {reminders['fetch_ms']:.1f} ms, "
+              f"envio {reminders['send_ms']:.1f} ms, {reminders['reminders_per_s']:.1f}/s)")
+        if baseline and baseline.get("reminders"):
+            print(f"lembretes/s vs. base: {change(baseline['reminders']['reminders_per_s'], reminders['reminders_per_s'])}")
+    for name, stats in results["caches"].items():
+        print(f"{name}: {stats}")
+
+
+def change(before, after):
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=200, help="pacientes simulados (um por chat)")
+    parser.add_argument("--concurrency", type=int, default=50, help="pacientes conversando ao mesmo tempo")
+    parser.add_argument("--days", type=int, default=30, help="dias com consultas semeadas")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="pesos das intenções, ex.: " + DEFAULT_MIX)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="segundos por geração do modelo simulado")
+    parser.add_argument("--classify-latency", type=float, default=0.01, help="segundos por classificação")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="segundos por send_message do bot falso")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pausa do paciente antes de informar a nova data")
+    parser.add_argument("--reminder-rate", type=float, default=None,
+                        help="limite global de lembretes/s (padrão: REMINDER_GLOBAL_RATE)")
+    parser.add_argument("--no-response-cache", action="store_true", help="gera todas as respostas pelo modelo")
+    parser.add_argument("--skip-reminders", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default=None, help="arquivo SQLite (padrão: temporário, apagado ao final)")
+    parser.add_argument("--save", help="grava os resultados em JSON")
+    parser.add_argument("--compare", help="compara com resultados gravados por --save")
+    args = parser.parse_args()
+
+    if args.db and os.path.exists(args.db):
+        raise SystemExit(f"{args.db} já existe; o benchmark precisa de um banco novo")
+    # O diretório temporário (banco padrão e arquivo de contingência) é apagado ao final
+    with tempfile.TemporaryDirectory(prefix="e2e_bench_") as workdir:
+        path = args.db or os.path.join(workdir, "bench.sqlite3")
+        seeded = seed_database(path, args.patients, args.days, random.Random(args.seed))
+        print(f"Banco {path}: {args.patients} pacientes, {seeded} consultas em {args.days} dias")
+
+        install_stub_llm(args.llm_latency, args.classify_latency)
+        db_async.repository._backend = SQLiteBackend(path)
+        # Os diálogos que não couberem no banco ficam no diretório temporário
+        bot.dialogue_sink.spill_path = os.path.join(workdir, "dialogues_spill.jsonl")
+        if args.no_response_cache:
+            bot.canned_responses.cache = ResponseCache(max_entries=0)
+        if args.reminder_rate:
+            bot.reminder_dispatcher.global_bucket = TokenBucket(args.reminder_rate)
+
+        results = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+        print(f"Resultados gravados em {args.save}")
+
+
+if __name__ == "__main__":
+    main()
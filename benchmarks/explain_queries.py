@@ -0,0 +1,86 @@
+"""Verifica se as consultas de db.py e db_async.py usam índices.
+
+Cria um banco SQLite temporário com as migrações de migrations.py, roda EXPLAIN QUERY PLAN
+em cada consulta encontrada nos dois módulos e falha (código de saída 1) se alguma delas
+percorrer uma tabela inteira (SCAN). INSERTs sem SELECT não têm plano e são ignorados.
+
+Uso:
+    python benchmarks/explain_queries.py [--verbose]
+"""
+import argparse
+import ast
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import migrations  # noqa: E402
+
+MODULES = ("db.py", "db_async.py")
+# As consultas do repositório são escritas com as palavras-chave em maiúsculas
+STATEMENT = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE)\s")
+
+
+def _query_text(node):
+    """Texto da consulta em uma string ou f-string (partes interpoladas viram o placeholder %s)."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        return "".join(part.value if isinstance(part, ast.Constant) else "%s" for part in node.values)
+    return None
+
+
+def find_queries(path):
+    """[(linha, consulta)] das strings SQL do módulo."""
+    with open(path, encoding="utf-8") as source:
+        tree = ast.parse(source.read(), path)
+    queries = []
+    for node in ast.walk(tree):
+        text = _query_text(node)
+        if text and STATEMENT.match(text):
+            queries.append((node.lineno, text))
+    # As partes constantes de uma f-string também aparecem no ast.walk: fica só a string inteira
+    return sorted((line, text) for line, text in queries
+                  if not any(text != other and text in other for _, other in queries))
+
+
+def query_plan(connection, query):
+    # Mesma tradução do SQLiteBackend: placeholder do MySQL e FOR UPDATE (a transação já trava o banco)
+    query = query.replace("FOR UPDATE", "").replace("%s", "?")
+    rows = connection.execute("EXPLAIN QUERY PLAN " + query, [None] * query.count("?")).fetchall()
+    return [row[-1] for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--verbose", action="store_true", help="mostra o plano de todas as consultas")
+    args = parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, "explain.sqlite3"))
+        migrations.migrate(connection, "sqlite")
+        for module in MODULES:
+            for line, query in find_queries(os.path.join(ROOT, module)):
+                plan = query_plan(connection, query)
+                scans = [step for step in plan if step.startswith("SCAN")]
+                failures += bool(scans)
+                if scans or args.verbose:
+                    status = "SCAN" if scans else "ok"
+                    print(f"{status:4} {module}:{line}: {' '.join(query.split())[:90]}")
+                    for step in plan:
+                        print(f"       {step}")
+        connection.close()
+
+    if failures:
+        print(f"{failures} consulta(s) percorrem a tabela inteira")
+        raise SystemExit(1)
+    print("Todas as consultas usam índices")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Mede acurácia e velocidade do motor de intenções contra o corpus rotulado.
+
+Uso:
+    python benchmarks/intent_bench.py [--repeat 2000]
+
+A classificação pelo modelo não é usada: mensagens abaixo do limiar de confiança
+contam como "intenção não identificada", o que mostra quantas iriam para o modelo.
+Os "erros com confiança" são os que o modelo não teria a chance de corrigir.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import intent  # noqa: E402
+from config import INTENT_CONFIDENCE_THRESHOLD  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_corpus.tsv")
+
+
+# Versão anterior de bot.analyze_intent, mantida para comparação
+def legacy_analyze_intent(patient_response):
+    response = patient_response.lower()
+
+    if "confirmar" in response or "confirmo" in response or "sim" in response:
+        return "confirmar"
+    elif "remarcar" in response or "adiar" in response or "mudar" in response:
+        return "remarcar"
+    elif "cancelar" in response or "não posso" in response or "desmarcar":
+        return "cancelar"
+    else:
+        return "intenção não identificada"
+
+
+def rules_only(text):
+    result = intent.match_intent(text)
+    return result.intent if result.confidence >= INTENT_CONFIDENCE_THRESHOLD else intent.NAO_IDENTIFICADA
+
+
+def load_corpus(path=CORPUS_PATH):
+    corpus = []
+    with open(path, encoding="utf-8") as lines:
+        for line in lines:
+            if line.strip() and not line.startswith("#"):
+                label, text = line.rstrip("\n").split("\t", 1)
+                corpus.append((label, text))
+    return corpus
+
+
+def evaluate(name, classify, corpus, repeat):
+    errors = [(label, text, classify(text)) for label, text in corpus if classify(text) != label]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, text in corpus:
+            classify(text)
+    elapsed = time.perf_counter() - start
+    per_message = elapsed / (repeat * len(corpus)) * 1e6
+    accuracy = 1 - len(errors) / len(corpus)
+    print(f"{name:<10} acurácia={accuracy:6.1%}  {per_message:6.2f} µs/mensagem")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--show-errors", action="store_true")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    print(f"{len(corpus)} mensagens rotuladas")
+    legacy_errors = evaluate("anterior", legacy_analyze_intent, corpus, args.repeat)
+    errors = evaluate("regras", rules_only, corpus, args.repeat)
+    fallbacks = sum(1 for _, text in corpus if intent.match_intent(text).confidence < INTENT_CONFIDENCE_THRESHOLD)
+    print(f"mensagens que iriam para o modelo: {fallbacks}")
+    # Erros que o modelo não corrige: as regras erram com confiança acima do limiar
+    confident_errors = [(label, text, predicted) for label, text, predicted in errors
+                        if predicted != intent.NAO_IDENTIFICADA]
+    print(f"erros com confiança (sem passar pelo modelo): {len(confident_errors)}")
+
+    if args.show_errors:
+        for name, listed in (("anterior", legacy_errors), ("regras", errors)):
+            for label, text, predicted in listed:
+                print(f"[{name}] esperado={label!r} obtido={predicted!r}: {text}")
+
+
+if __name__ == "__main__":
+    main()
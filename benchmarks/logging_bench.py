@@ -0,0 +1,152 @@
+"""Mede o custo por mensagem de log na thread que chama o logging (o event loop do bot).
+
+Compara a configuração anterior (basicConfig + BrazilFormatter, f-strings com cores) com a fila
+de log_config (QueueHandler + listener), em texto e JSON, e o custo de mensagens abaixo do nível.
+A saída vai para /dev/null, para medir só o logging.
+
+Uso:
+    python benchmarks/logging_bench.py [--messages 20000] [--burst 10] [--write-latency 0.0001]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from colorama import Fore, Style  # noqa: E402
+import log_config  # noqa: E402
+
+# Pausa entre rajadas, em que o listener formata e escreve as mensagens
+PAUSE = 0.002
+
+PROMPT = ("[INST] Você é uma secretária de um consultório médico. Responda as solicitação de forma breve e "
+          "educada. O paciente enviou a seguinte solicitação: Agradeça ao paciente por confirmar a consulta "
+          "e deseje um bom dia. [/INST]")
+
+
+# Versão anterior de bot.BrazilFormatter, mantida para comparação
+class LegacyBrazilFormatter(logging.Formatter):
+    def format(self, record):
+        if record.levelname == 'ERROR':
+            record.msg = f"{Fore.RED}{record.msg}{Style.RESET_ALL}"
+        elif record.levelname == 'INFO':
+            record.msg = f"{Fore.CYAN}{record.msg}{Style.RESET_ALL}"
+        elif record.levelname == 'WARNING':
+            record.msg = f"{Fore.YELLOW}{record.msg}{Style.RESET_ALL}"
+        return super().format(record)
+
+
+# Saída que demora `latency` segundos por escrita (terminal lento, pipe cheio, disco)
+class SlowStream:
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def reset_root():
+    log_config.stop_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+def legacy_setup(stream):
+    reset_root()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(LegacyBrazilFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logging.getLogger().addHandler(handler)
+
+
+def legacy_message(i):
+    user_input = f"amanhã às {i % 24}h"
+    logging.info(f"{Fore.YELLOW}Recebido input para análise de data e hora: {user_input}{Style.RESET_ALL}")
+
+
+def lazy_message(i):
+    logging.info("Recebido input para análise de data e hora: %s", f"amanhã às {i % 24}h")
+
+
+def legacy_prompt(stream):
+    # model.generate_text imprimia o prompt inteiro com print()
+    print(f"{Fore.CYAN}Prompt enviado ao modelo: {PROMPT}{Style.RESET_ALL}", file=stream)
+
+
+def lazy_prompt(stream):
+    logging.info("Prompt enviado ao modelo: %s", log_config.LogBody(PROMPT))
+
+
+def legacy_debug(i):
+    logging.debug(f"Intenção: confirmar (confiança {0.9:.2f}, regras) #{i}")
+
+
+def lazy_debug(i):
+    logging.debug("Intenção: %s (confiança %.2f, %s) #%d", "confirmar", 0.9, "regras", i)
+
+
+def measure(func, messages, burst, stream=None):
+    """Retorna o custo médio por chamada (µs) na thread atual.
+
+    As mensagens são enviadas em rajadas de `burst`, com uma pausa (não medida) entre elas,
+    como o bot faz a cada update; assim o listener não disputa o GIL durante a medição.
+    """
+    elapsed = 0.0
+    for first in range(0, messages, burst):
+        start = time.perf_counter()
+        for i in range(first, min(first + burst, messages)):
+            func(stream) if stream is not None else func(i)
+        elapsed += time.perf_counter() - start
+        time.sleep(PAUSE)
+    return elapsed / messages * 1e6
+
+
+def run_case(name, setup, func, messages, burst, stream, with_stream_arg=False):
+    setup()
+    caller = measure(func, messages, burst, stream if with_stream_arg else None)
+    log_config.stop_logging()
+    print(f"{name:45} {caller:8.2f} µs/msg na thread do bot")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--burst", type=int, default=10, help="mensagens por rajada (um update gera poucas)")
+    parser.add_argument("--write-latency", type=float, default=0.0,
+                        help="segundos de espera por escrita na saída, para simular E/S lenta")
+    args = parser.parse_args()
+    n, burst = args.messages, args.burst
+
+    with open(os.devnull, "w") as null:
+        devnull = SlowStream(null, args.write_latency)
+        print(f"{n} mensagens por caso, {args.write_latency * 1e6:.0f} µs por escrita")
+        run_case("anterior: BrazilFormatter + f-string", lambda: legacy_setup(devnull), legacy_message, n, burst, devnull)
+        run_case("fila + listener (texto)", lambda: log_config.setup_logging(log_format="text", stream=devnull),
+                 lazy_message, n, burst, devnull)
+        run_case("fila + listener (JSON)", lambda: log_config.setup_logging(log_format="json", stream=devnull),
+                 lazy_message, n, burst, devnull)
+
+        print()
+        run_case("anterior: print() do prompt completo", reset_root, legacy_prompt, n, burst, devnull, with_stream_arg=True)
+        run_case("fila + LogBody (JSON, cortado)", lambda: log_config.setup_logging(log_format="json", stream=devnull),
+                 lazy_prompt, n, burst, devnull, with_stream_arg=True)
+
+        print()
+        run_case("abaixo do nível: f-string", lambda: log_config.setup_logging(log_format="json", stream=devnull),
+                 legacy_debug, n, burst, devnull)
+        run_case("abaixo do nível: argumentos (lazy)", lambda: log_config.setup_logging(log_format="json", stream=devnull),
+                 lazy_debug, n, burst, devnull)
+    reset_root()
+
+
+if __name__ == "__main__":
+    main()
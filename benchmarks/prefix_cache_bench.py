@@ -0,0 +1,69 @@
+"""Compara o tempo até o primeiro token com e sem o cache de prefixo.
+
+Uso:
+    python benchmarks/prefix_cache_bench.py --model caminho/para/modelo.gguf --runs 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import model  # noqa: E402
+
+PROMPTS = [
+    "O paciente confirmou que virá à consulta.",
+    "O paciente deseja remarcar. Perguntar apenas para qual data remarcar.",
+    "O paciente cancelou a consulta. Marcar como cancelada e encerrar a conversa.",
+    "A intenção do paciente não foi identificada, peça mais detalhes.",
+]
+
+
+# Mede o tempo até o primeiro token e o tempo total de uma geração em streaming
+def timed_generation(llm, prompt, max_tokens):
+    start = time.perf_counter()
+    first_token = None
+    for _ in llm(prompt, max_tokens=max_tokens, stop=["\n", "</s>"], stream=True):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+    return first_token or 0.0, time.perf_counter() - start
+
+
+def run(llm, runs, max_tokens, use_prefix_cache):
+    prefix_cache = model.PrefixCache()
+    ttft, total = [], []
+    for i in range(runs):
+        prefix, prompt = model.build_prompt(PROMPTS[i % len(PROMPTS)])
+        if use_prefix_cache:
+            prefix_cache.restore(llm, prefix)
+        else:
+            llm.reset()
+        first, elapsed = timed_generation(llm, prompt, max_tokens)
+        ttft.append(first)
+        total.append(elapsed)
+    return ttft, total
+
+
+def report(label, ttft, total):
+    print(f"{label:<14} ttft p50={statistics.median(ttft) * 1000:8.1f}ms  "
+          f"max={max(ttft) * 1000:8.1f}ms  total p50={statistics.median(total) * 1000:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=model.MODEL_PATH)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=16)
+    args = parser.parse_args()
+
+    llm = model.ModelManager(model_path=args.model).load()
+
+    # A primeira medição do modo com cache inclui a avaliação do prefixo (um "miss")
+    report("frio", *run(llm, args.runs, args.max_tokens, use_prefix_cache=False))
+    report("com prefixo", *run(llm, args.runs, args.max_tokens, use_prefix_cache=True))
+
+
+if __name__ == "__main__":
+    main()
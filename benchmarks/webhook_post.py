@@ -0,0 +1,88 @@
+"""Envia updates falsos ao servidor de webhook.py, como o Telegram faria.
+
+Inicie o bot com BOT_MODE = "webhook" em config.py e rode:
+    python benchmarks/webhook_post.py [--chats 50] [--messages 5] [--concurrency 20]
+
+Cada chat envia suas mensagens em ordem; chats diferentes são enviados em paralelo.
+Mostra a latência dos POSTs (aceite pelo servidor, não a resposta do bot) e os códigos HTTP.
+O encerramento do servidor informa quantos updates cada processo recebeu.
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN  # noqa: E402
+
+MESSAGES = ["Sim, confirmo", "Preciso remarcar", "amanhã às 15h", "quero cancelar", "bom dia"]
+FIRST_CHAT_ID = 10_000_000
+
+_update_ids = itertools.count(1)
+
+
+def fake_update(chat_id, text):
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": f"Paciente {chat_id}"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"Paciente {chat_id}"},
+            "text": text,
+        },
+    }
+
+
+def post(url, update):
+    headers = {"Content-Type": "application/json"}
+    if WEBHOOK_SECRET_TOKEN:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = WEBHOOK_SECRET_TOKEN
+    request = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"), headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - start
+
+
+def send_chat(url, chat_id, messages):
+    return [post(url, fake_update(chat_id, MESSAGES[i % len(MESSAGES)])) for i in range(messages)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5, help="mensagens por chat")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(itertools.chain.from_iterable(executor.map(
+            lambda chat_id: send_chat(args.url, chat_id, args.messages),
+            range(FIRST_CHAT_ID, FIRST_CHAT_ID + args.chats))))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for _, latency in results)
+    print(f"{len(results)} updates em {elapsed:.2f}s ({len(results) / elapsed:.1f} updates/s)")
+    print(f"códigos: {dict(Counter(status for status, _ in results))}")
+    print(f"latência do POST: p50 {statistics.median(latencies) * 1000:.2f} ms, "
+          f"p99 {latencies[int(0.99 * (len(latencies) - 1))] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
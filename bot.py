@@ -1,45 +1,27 @@
 import logging
 from telegram import Update, ReplyKeyboardRemove
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ConversationHandler, ContextTypes
-from model import generate_text
-from config import TELEGRAM_TOKEN
-from db import (create_connection, get_appointments_in_next_24_hours, 
-                mark_reminder_sent, get_appointment_by_telegram_id, 
-                save_dialogue, delete_appointment, check_availability, 
-                add_appointment, find_next_available_time, get_appointment_by_patient_id, get_patient_by_telegram_id)
-from dateutil import parser
+from model import (generate_text, generate_text_async, stream_text_async, classify_text_async,
+                   model_manager, inference_queue)
+from intent import IntentEngine
+from streaming import stream_reply
+from response_cache import canned_responses
+from config import (TELEGRAM_TOKEN, MODEL_EAGER_LOAD, RESPONSE_CACHE_PRECOMPUTE, RESPONSE_STREAMING,
+                    METRICS_DUMP_INTERVAL, BOT_MODE, CONVERSATION_STORE_PATH, CONVERSATION_TIMEOUT,
+                    CONVERSATION_CLEANUP_INTERVAL, COALESCE_WINDOW)
+from db_async import repository
+from db import format_time_value
+from reminders import ReminderDispatcher, ReminderScheduler
+from dialogue_sink import DialogueSink
+from lookup_cache import LookupCache
+from conversation_store import StatePersistence
+import input_aggregator
+import date_parser
+import metrics
 from datetime import datetime, timedelta
 import pytz
-import re
-import logging
-from colorama import Fore, Style, init
-
-
-# Inicializa o uso de cores no terminal
-init()
-
-
-# Configuração básica de logging com cores
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    level=logging.INFO
-)
-
-#Formata os logs para mostrar o horário de Brasília e aplicar cores.
-class BrazilFormatter(logging.Formatter):    
-    def format(self, record):
-        if record.levelname == 'ERROR':
-            record.msg = f"{Fore.RED}{record.msg}{Style.RESET_ALL}"
-        elif record.levelname == 'INFO':
-            record.msg = f"{Fore.CYAN}{record.msg}{Style.RESET_ALL}"
-        elif record.levelname == 'WARNING':
-            record.msg = f"{Fore.YELLOW}{record.msg}{Style.RESET_ALL}"
-        return super().format(record)
-
-# Aplicar o formato com cores a todos os handlers
-for handler in logging.getLogger().handlers:
-    handler.setFormatter(BrazilFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+import log_config
+import webhook
 
 # Fuso horário de Brasília
 BRAZIL_TZ = pytz.timezone("America/Sao_Paulo")
@@ -50,66 +32,65 @@ NEW_DATE, CONFIRM_REMARK = range(2)
 # Função para converter timedelta em horas e minutos
 def format_timedelta_as_time(timedelta_obj):
     """Converte um objeto timedelta para o formato HH:MM."""
+    if not isinstance(timedelta_obj, timedelta):
+        # O SQLite (DB_ASYNC_DRIVER = "sqlite") retorna a hora como texto
+        return format_time_value(timedelta_obj)[:5]
     total_seconds = int(timedelta_obj.total_seconds())
     hours, remainder = divmod(total_seconds, 3600)
     minutes, _ = divmod(remainder, 60)
     return f"{hours:02d}:{minutes:02d}"
 
-# Função para o LLaMA 2 gerar respostas
-def llama_generate_response(prompt):
-    return generate_text(prompt)
+# Formata os horários [(data, hora)] sugeridos ao paciente, ex.: "25/12/2024 às 09:00, 25/12/2024 às 10:00"
+def format_slots(slots):
+    return ", ".join(f"{day.strftime('%d/%m/%Y')} às {slot_time.strftime('%H:%M')}" for day, slot_time in slots)
 
-# Substitui expressões comuns para o bot entender.
-def replace_common_expressions(user_input):
-    now = datetime.now(BRAZIL_TZ)
-    
-    expressões = {
-        "amanhã": (now + timedelta(days=1)).strftime('%d/%m/%Y'),
-        "hoje": now.strftime('%d/%m/%Y'),
-        "daqui a uma semana": (now + timedelta(weeks=1)).strftime('%d/%m/%Y'),
-    }
-    
-    # Para expressões como 'daqui a X dias'
-    dias_match = re.search(r'daqui a (\d+) dias', user_input)
-    if dias_match:
-        dias = int(dias_match.group(1))
-        nova_data = (now + timedelta(days=dias)).strftime('%d/%m/%Y')
-        user_input = re.sub(r'daqui a \d+ dias', nova_data, user_input)
-
-    # Substituir expressões padrão
-    for expressão, data in expressões.items():
-        user_input = user_input.replace(expressão, data)
-
-    return user_input
+# Função para o LLaMA 2 gerar respostas
+async def llama_generate_response(prompt):
+    return await generate_text_async(prompt)
+
+# Gera e envia ao paciente a resposta para um prompt fixo (ver response_cache.CANNED_PROMPTS),
+# usando o cache quando possível; retorna o texto enviado.
+# Com RESPONSE_STREAMING, respostas que não estão no cache são enviadas conforme o modelo gera.
+async def send_canned_response(update: Update, context: ContextTypes.DEFAULT_TYPE, name, reply_markup=None, **slots):
+    streamed = False
+
+    async def generate(prompt):
+        nonlocal streamed
+        if not RESPONSE_STREAMING:
+            return await llama_generate_response(prompt)
+        streamed = True
+        return await stream_reply(update.message, context.bot, stream_text_async(prompt), reply_markup=reply_markup)
+
+    response = await canned_responses.get(name, generate, **slots)
+    if not streamed:
+        await update.message.reply_text(response, reply_markup=reply_markup)
+    return response
 
 # Tenta interpretar a data e hora de um texto fornecido pelo usuário.
+# Retorna (data YYYY-MM-DD, hora HH:MM:SS); a hora é None quando o paciente não a informou.
+@metrics.timed(metrics.DATE_PARSE_SECONDS)
 def parse_date_time(user_input):
-    try:
-        logging.info(f"{Fore.YELLOW}Recebido input para análise de data e hora: {user_input}{Style.RESET_ALL}")
-        
-        # Substituir expressões comuns e limpar o input
-        user_input = replace_common_expressions(user_input.lower())
-        user_input = " ".join(user_input.split())  # Remover espaços extras
-        
-        # Tenta analisar a data usando o parser e converter o formato
-        parsed_datetime = parser.parse(user_input, dayfirst=True, fuzzy=True)
-        new_date = convert_date_format(parsed_datetime.strftime('%d/%m/%Y'))  # Converte para formato YYYY-MM-DD
-        new_time = parsed_datetime.strftime('%H:%M:%S')  # Horário em HH:MM:SS
-        
-        logging.info(f"{Fore.GREEN}Data e hora interpretadas com sucesso: {new_date} {new_time}{Style.RESET_ALL}")
-        return new_date, new_time
+    logging.info("Recebido input para análise de data e hora: %s", user_input)
 
-    except ValueError:
-        logging.error(f"{Fore.RED}Falha ao interpretar a data e hora fornecidas: {user_input}{Style.RESET_ALL}")
+    parsed = date_parser.parse(user_input)
+    if parsed is None:
+        logging.error("Falha ao interpretar a data e hora fornecidas: %s", user_input)
         return None, None
 
+    logging.info("Data e hora interpretadas com sucesso: %s %s (%s)", parsed.date, parsed.time, parsed.time_source)
+    return parsed.date, parsed.time
+
 # Função chamada quando o comando /start é enviado
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('Olá! Eu sou um bot de atendimento, como posso ajudar?')
 
+# Envia os lembretes em paralelo, respeitando os limites do Telegram, e marca os enviados em lote
+reminder_dispatcher = ReminderDispatcher(repository.mark_reminders_sent)
+
 # Função para enviar lembretes aos pacientes com horário no padrão brasileiro
-async def send_reminders(context: ContextTypes.DEFAULT_TYPE):
-    appointments = get_appointments_in_next_24_hours()
+@metrics.timed(metrics.HANDLER_SECONDS, handler="send_reminders")
+async def send_reminders(context: ContextTypes.DEFAULT_TYPE, appointments):
+    reminders = []
     
     for appointment in appointments:
         appointment_id, appointment_date, appointment_time, name, telegram_id = appointment
@@ -122,37 +103,38 @@ async def send_reminders(context: ContextTypes.DEFAULT_TYPE):
         
         # Mensagem humanizada com a data e hora no padrão brasileiro
         reminder_message = f"Olá {name}, lembrete do seu compromisso marcado para o dia {formatted_date} às {formatted_time}. Por favor, confirme, remarque ou cancele sua consulta."
-        
-        await context.bot.send_message(chat_id=telegram_id, text=reminder_message)
-        mark_reminder_sent(appointment_id)
+        reminders.append((appointment_id, telegram_id, reminder_message))
+
+    if reminders:
+        return await reminder_dispatcher.dispatch(context.bot, reminders)
+    return None
+
+# Dispara cada lembrete no horário exato (24 horas antes da consulta)
+reminder_scheduler = ReminderScheduler(repository, send_reminders)
+
+# Motor de intenções: regras compiladas e, com baixa confiança, classificação pelo modelo
+intent_engine = IntentEngine(classify_text_async)
 
 # Função para analisar a intenção do paciente
-def analyze_intent(patient_response):
-    response = patient_response.lower()
-
-    if "confirmar" in response or "confirmo" in response or "sim" in response:
-        return "confirmar"
-    elif "remarcar" in response or "adiar" in response or "mudar" in response:
-        return "remarcar"
-    elif "cancelar" in response or "não posso" in response or "desmarcar":
-        return "cancelar"
-    else:
-        return "intenção não identificada"
+async def analyze_intent(patient_response):
+    result = await intent_engine.analyze(patient_response)
+    metrics.INTENTS.inc(intent=result.intent, source=result.source)
+    logging.info("Intenção: %s (confiança %.2f, %s)", result.intent, result.confidence, result.source)
+    return result.intent
 
 # Função para capturar a resposta do paciente e identificar a intenção
+@metrics.timed(metrics.HANDLER_SECONDS, handler="handle_patient_response")
 async def handle_patient_response(update: Update, context):
     """Captura a resposta do paciente e identifica a intenção"""
+    metrics.start_trace(update.update_id)
     patient_response = update.message.text
     patient_telegram_id = update.message.chat_id
     
     # Analisar a intenção do paciente
-    intent = analyze_intent(patient_response)
-    
-    # Exibir a intenção no terminal
-    print(f"Intenção identificada: {intent}")
+    intent = await analyze_intent(patient_response)
     
     # Obter o compromisso do paciente
-    appointment = get_appointment_by_telegram_id(patient_telegram_id)
+    appointment = await lookups.get_appointment_by_telegram_id(patient_telegram_id)
 
     if appointment:
         # Ajustar para capturar os quatro valores retornados
@@ -163,65 +145,35 @@ async def handle_patient_response(update: Update, context):
     
     # Se o paciente confirmou, nada muda
     if intent == "confirmar":
-        response = llama_generate_response(f"O paciente confirmou que virá à consulta, nao diga nada antes da resposta, apenas diga que entendeu e a consulta esta confirmada, nada mais.")
+        response = await send_canned_response(update, context, "confirmar")
     
     # Se o paciente deseja cancelar, apaga o compromisso
     elif intent == "cancelar":
-        delete_appointment(appointment_id)
-        response = llama_generate_response("O paciente cancelou a consulta. Marcar como cancelada e encerrar a conversa.")
+        await repository.delete_appointment(appointment_id)
+        response = await send_canned_response(update, context, "cancelar")
 
     # Se o paciente deseja remarcar, pergunta o novo horário
     elif intent == "remarcar":
-        response = llama_generate_response("O paciente deseja remarcar. Perguntar apenas para qual data remarcar.")
-        await update.message.reply_text(response)
+        await send_canned_response(update, context, "remarcar")
         
         # Iniciar o estado de aguardo para o novo horário
         return NEW_DATE
 
     else:
-        response = llama_generate_response("A intenção do paciente não foi identificada, peça mais detalhes.")
+        response = await send_canned_response(update, context, "nao_identificada")
 
     # Salvar o diálogo no banco de dados
-    save_dialogue(patient_telegram_id, patient_response, response)
-
-    # Envia a resposta gerada ao paciente
-    await update.message.reply_text(response)
+    await dialogue_sink.save(patient_telegram_id, patient_response, response)
 
     return ConversationHandler.END
 
-# Verifica se o formato do input é DD/MM/YYYY e converte para YYYY-MM-DD
-def convert_date_format(user_date):
-    try:
-        parsed_date = datetime.strptime(user_date, '%d/%m/%Y')
-        return parsed_date.strftime('%Y-%m-%d')
-    except ValueError:
-        return None
-
 # Função para lidar com o novo horário
+@metrics.timed(metrics.HANDLER_SECONDS, handler="handle_reschedule")
 async def handle_reschedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    metrics.start_trace(update.update_id)
     new_response = update.message.text
-    logging.info(f"{Fore.YELLOW}Recebido novo horário para remarcar: {new_response}{Style.RESET_ALL}")
-    
-    # Obter o patient_id associado ao user_id do Telegram (from_user.id)
-    patient = get_patient_by_telegram_id(update.message.from_user.id)
-    
-    if not patient:
-        await update.message.reply_text("Não encontrei nenhum paciente associado ao seu Telegram.")
-        return ConversationHandler.END
-    
-    patient_id = patient[0]  # O patient_id será retornado
+    logging.info("Recebido novo horário para remarcar: %s", new_response)
     
-    logging.info(f"Patient ID encontrado: {patient_id}")
-    
-    # busca o compromisso associado a esse patient_id
-    appointment = get_appointment_by_patient_id(patient_id)
-    if not appointment:
-        await update.message.reply_text("Não encontrei nenhum compromisso para você.")
-        return ConversationHandler.END
-    
-    logging.info(f"Compromisso encontrado: {appointment}")
-    
-    appointment_id, original_date, original_time, patient_id = appointment
     # Tentar interpretar a nova data e hora
     new_date, new_time = parse_date_time(new_response)
     
@@ -229,50 +181,130 @@ async def handle_reschedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Data inválida, por favor tente novamente.")
         return NEW_DATE
 
-    if not new_time:
-        # Se a hora não for especificada, mantém o horário original
-        new_time = original_time
+    # Busca o compromisso, verifica o horário e remarca em uma única transação
+    # (sem new_time, o horário original é mantido)
+    result = await repository.reschedule_appointment(update.message.from_user.id, new_date, new_time)
+
+    if result is None:
+        await update.message.reply_text("Não foi possível remarcar agora, por favor tente novamente.")
+        return NEW_DATE
 
-    # Verifica se há disponibilidade para o novo horário
-    if check_availability(new_date, new_time):
-        delete_appointment(appointment_id)  # Apaga o compromisso antigo
-        add_appointment(patient_id, new_date, new_time)  # Adiciona o novo compromisso para o mesmo paciente
-        response = llama_generate_response(f"Consulta remarcada para {new_date} às {new_time}. Agradecer e encerrar a conversa")
-        logging.info(f"{Fore.GREEN}Consulta remarcada com sucesso para {new_date} às {new_time}{Style.RESET_ALL}")
+    if result["status"] == "sem_compromisso":
+        await update.message.reply_text("Não encontrei nenhum compromisso para você.")
+        return ConversationHandler.END
+
+    if result["status"] == "remarcada":
+        appointment_id, new_date, new_time, patient_id = result["appointment"]
+        logging.info("Compromisso anterior: %s", result['previous'])
+        response = await send_canned_response(update, context, "remarcada", ReplyKeyboardRemove(), new_date=new_date, new_time=new_time)
+        logging.info("Consulta remarcada com sucesso para %s às %s", new_date, new_time)
+    elif result["alternatives"]:
+        # Sugere os próximos horários disponíveis se o solicitado não estiver livre ou estiver fora do expediente
+        next_times = format_slots(result["alternatives"])
+        prompt = "fora_do_expediente" if result["status"] == "fora_do_expediente" else "horario_ocupado"
+        response = await send_canned_response(update, context, prompt, ReplyKeyboardRemove(), next_times=next_times)
     else:
-        # Sugere o próximo horário disponível se o solicitado não estiver livre
-        next_time = find_next_available_time(new_date)
-        if next_time:
-            response = llama_generate_response(f"O horário solicitado está ocupado. O próximo horário disponível é {next_time}. Gostaria de marcar para esse horário?")
-        else:
-            response = llama_generate_response(f"Não há horários disponíveis para a data {new_date}. Por favor, escolha outra.")
+        response = await send_canned_response(update, context, "sem_horarios", ReplyKeyboardRemove(), new_date=new_date)
     
-    # Envia a resposta gerada pelo modelo
-    await update.message.reply_text(response, reply_markup=ReplyKeyboardRemove())
-    save_dialogue(update.message.from_user.id, new_response, response)
+    await dialogue_sink.save(update.message.from_user.id, new_response, response)
 
     return ConversationHandler.END
 
-# Função principal para iniciar o bot e agendar os lembretes
-def main():
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-    job_queue = application.job_queue
-
-    now_brazil = datetime.now(BRAZIL_TZ)
-    first_check = now_brazil + timedelta(seconds=60)
-    first_check_utc = first_check.astimezone(pytz.utc)
+# Cache das consultas de pacientes e compromissos por telegram_id
+lookups = LookupCache(repository)
+
+# Grava os diálogos em lote, fora do caminho da resposta
+dialogue_sink = DialogueSink(repository.save_dialogues)
+
+# Responde às mensagens que ainda aguardavam o agrupador, entre o stop() e o shutdown() da aplicação
+async def flush_pending_input(application):
+    aggregator = application.bot_data.get("input_aggregator")
+    if aggregator is not None:
+        await aggregator.close()
+
+# Grava os diálogos pendentes e libera o pool do banco assíncrono ao encerrar o bot
+async def close_resources(application):
+    await dialogue_sink.close()
+    await repository.close()
+
+# Carrega o modelo e pré-calcula as respostas fixas antes de receber mensagens
+def prepare_model():
+    # Carrega e aquece o modelo antes de começar a receber mensagens
+    if MODEL_EAGER_LOAD:
+        model_manager.load()
+        logging.info("Modelo pronto: %s", model_manager.status())
+
+    # Gera antecipadamente as variantes das respostas fixas
+    if RESPONSE_CACHE_PRECOMPUTE:
+        canned_responses.precompute(generate_text)
+
+# Remove as conversas expiradas do armazenamento e libera da memória os chats inativos
+async def cleanup_conversations(context: ContextTypes.DEFAULT_TYPE):
+    await context.application.persistence.cleanup(context.application)
+
+# Cria a aplicação com os handlers da conversa; sem `updater`, os updates são entregues
+# por quem chamar a aplicação (ver webhook.py)
+def build_application(updater=True):
+    builder = ApplicationBuilder().token(TELEGRAM_TOKEN).post_stop(flush_pending_input).post_shutdown(close_resources)
+    if not updater:
+        builder = builder.updater(None)
+    # Restaura quem estava no meio de uma remarcação após reiniciar o bot
+    persistence = StatePersistence() if CONVERSATION_STORE_PATH else None
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = builder.build()
 
     conv_handler = ConversationHandler(
         entry_points=[MessageHandler(filters.TEXT & ~filters.COMMAND, handle_patient_response)],
         states={
             NEW_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_reschedule)],
         },
-        fallbacks=[CommandHandler('start', start)]
+        fallbacks=[CommandHandler('start', start)],
+        name="remarcacao",
+        persistent=persistence is not None,
+        conversation_timeout=CONVERSATION_TIMEOUT or None
     )
 
     application.add_handler(conv_handler)
-    job_queue.run_repeating(send_reminders, interval=30, first=first_check_utc)
+    # Mensagens seguidas do mesmo chat viram um único turno da conversa
+    if COALESCE_WINDOW:
+        application.bot_data["input_aggregator"] = input_aggregator.install(application)
+    if persistence is not None:
+        application.job_queue.run_repeating(cleanup_conversations, interval=CONVERSATION_CLEANUP_INTERVAL)
+    return application
+
+# Agenda os lembretes e a cópia periódica das métricas (apenas um processo deve fazer isso)
+def start_jobs(application):
+    job_queue = application.job_queue
+
+    now_brazil = datetime.now(BRAZIL_TZ)
+    first_check = now_brazil + timedelta(seconds=60)
+    first_check_utc = first_check.astimezone(pytz.utc)
+
+    reminder_scheduler.start(job_queue, first=first_check_utc)
+    if METRICS_DUMP_INTERVAL:
+        job_queue.run_repeating(metrics.dump_metrics, interval=METRICS_DUMP_INTERVAL)
+
+# Função principal para iniciar o bot e agendar os lembretes
+def main():
+    # Logs formatados e escritos em uma thread separada (JSON fora de terminais)
+    log_config.setup_logging()
+
+    # Servidor HTTP + vários processos; cada processo carrega o seu próprio modelo
+    if BOT_MODE == "webhook":
+        webhook.serve()
+        log_config.stop_logging()
+        return
+
+    prepare_model()
+    application = build_application()
+    start_jobs(application)
+
+    # Latência por etapa: endpoint /metrics
+    metrics.start_http_server()
     application.run_polling()
+    inference_queue.shutdown()
+    log_config.stop_logging()
 
 if __name__ == "__main__":
     main()
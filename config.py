@@ -1,2 +1,215 @@
 # Token da API do Telegram
 TELEGRAM_TOKEN = "..."
+
+# Carrega o modelo LLaMA na inicialização do bot (False = carrega na primeira mensagem)
+MODEL_EAGER_LOAD = True
+
+# Número de gerações executadas ao mesmo tempo (o modelo é compartilhado, então 1 é o recomendado)
+INFERENCE_CONCURRENCY = 1
+
+# Quantidade máxima de pedidos aguardando na fila de inferência
+INFERENCE_QUEUE_SIZE = 8
+
+# Tempo máximo (em segundos) que um pedido espera pela resposta do modelo
+INFERENCE_TIMEOUT = 60
+
+# Mensagem enviada quando a fila está cheia ou a geração excede o tempo limite
+INFERENCE_BUSY_MESSAGE = "Estamos com muitas solicitações no momento. Por favor, tente novamente em instantes."
+
+# Quantidade máxima de prompts guardados no cache de respostas
+RESPONSE_CACHE_SIZE = 256
+
+# Tempo de vida (em segundos) das respostas guardadas no cache
+RESPONSE_CACHE_TTL = 6 * 60 * 60
+
+# Número de variantes guardadas por prompt (o bot alterna entre elas)
+RESPONSE_CACHE_VARIANTS = 3
+
+# Pré-calcula as variantes dos prompts fixos na inicialização do bot
+RESPONSE_CACHE_PRECOMPUTE = False
+
+# Reaproveita o estado do modelo após avaliar o prefixo fixo do prompt
+PREFIX_CACHE_ENABLED = True
+
+# Quantidade de snapshots de prefixo guardados (cada um ocupa a memória do KV cache)
+PREFIX_CACHE_SIZE = 2
+
+# Envia a resposta do modelo em streaming, editando a mensagem conforme os tokens chegam
+RESPONSE_STREAMING = False
+
+# Intervalo mínimo (em segundos) entre duas edições da mesma mensagem
+STREAM_EDIT_INTERVAL = 1.5
+
+# Texto mostrado enquanto o modelo começa a gerar a resposta
+STREAM_PLACEHOLDER = "..."
+
+# Informações de conexão com o banco de dados MySQL
+DB_HOST = "<endereço_host>"
+DB_USER = "<usuario>"
+DB_PASSWORD = "<senha>"
+DB_NAME = "<nome_do_banco>"
+
+# Quantidade máxima de conexões abertas no pool
+DB_POOL_SIZE = 5
+
+# Tempo máximo (em segundos) aguardando uma conexão livre no pool
+DB_POOL_TIMEOUT = 5
+
+# Verifica se a conexão ociosa ainda está ativa antes de emprestá-la
+DB_POOL_PRE_PING = True
+
+# Driver usado pelos handlers assíncronos: "mysql" (aiomysql) ou "sqlite" (aiosqlite, para testes locais)
+DB_ASYNC_DRIVER = "mysql"
+
+# Arquivo do banco SQLite usado quando DB_ASYNC_DRIVER = "sqlite"
+DB_SQLITE_PATH = "clinicdb.sqlite3"
+
+# Quantidade máxima de lembretes sendo enviados ao mesmo tempo
+REMINDER_CONCURRENCY = 20
+
+# Limites de envio do Telegram: mensagens por segundo no total e por chat
+REMINDER_GLOBAL_RATE = 30
+REMINDER_PER_CHAT_RATE = 1
+
+# Quantidade de lembretes marcados como enviados em cada UPDATE
+REMINDER_BATCH_SIZE = 100
+
+# Novas tentativas para falhas de rede, com espera inicial (em segundos) dobrada a cada tentativa
+REMINDER_MAX_RETRIES = 3
+REMINDER_RETRY_BACKOFF = 1.0
+
+# Antecedência (em horas) com que o lembrete é enviado antes da consulta
+REMINDER_LEAD_HOURS = 24
+
+# Margem (em minutos) carregada além da janela de lembretes a cada ressincronização
+# (deve ser maior que REMINDER_RESYNC_INTERVAL para que nenhum lembrete seja carregado atrasado)
+REMINDER_LOOKAHEAD_MINUTES = 15
+
+# Intervalo (em segundos) entre as ressincronizações da agenda de lembretes com o banco
+REMINDER_RESYNC_INTERVAL = 300
+
+# Lembretes não entregues por falha temporária (rede, limite do Telegram) voltam à agenda:
+# espera (em segundos) antes da primeira nova tentativa, dobrada a cada falha, e máximo de tentativas
+REMINDER_REQUEUE_DELAY = 60
+REMINDER_REQUEUE_ATTEMPTS = 5
+
+# Duração (em minutos) de cada horário de consulta
+SLOT_MINUTES = 60
+
+# Horário de atendimento por dia da semana (0 = segunda-feira), como intervalos (início, fim)
+WORKING_HOURS = {weekday: [("08:00", "18:00")] for weekday in range(7)}
+
+# Tempo (em segundos) que os horários ocupados de um dia ficam em memória antes de recarregar
+SLOT_INDEX_TTL = 300
+
+# Quantidade de horários alternativos sugeridos e dias pesquisados quando o horário pedido está ocupado
+RESCHEDULE_ALTERNATIVES = 3
+RESCHEDULE_SEARCH_DAYS = 7
+
+# Diálogos gravados por lote e intervalo máximo (em segundos) entre gravações
+DIALOGUE_BATCH_SIZE = 50
+DIALOGUE_FLUSH_INTERVAL = 2.0
+
+# Quantidade máxima de diálogos aguardando gravação em memória
+DIALOGUE_BUFFER_SIZE = 1000
+
+# Arquivo usado quando o banco está indisponível (None para descartar)
+DIALOGUE_SPILL_PATH = "dialogues_spill.jsonl"
+
+# Tempo (em segundos) que pacientes e compromissos consultados ficam em cache
+LOOKUP_CACHE_TTL = 300
+
+# Tempo (em segundos) em cache das consultas sem resultado (ex.: paciente sem compromisso)
+LOOKUP_CACHE_NEGATIVE_TTL = 30
+
+# Quantidade máxima de entradas no cache de pacientes e compromissos (as menos usadas são descartadas)
+LOOKUP_CACHE_SIZE = 10000
+
+# Confiança mínima das regras de intenção; abaixo dela o modelo classifica a mensagem
+INTENT_CONFIDENCE_THRESHOLD = 0.5
+
+# Quantidade de classificações do modelo guardadas em cache
+INTENT_FALLBACK_CACHE_SIZE = 1024
+
+# Quantidade de textos de data/hora interpretados guardados em cache
+DATE_PARSER_CACHE_SIZE = 4096
+
+# Horário usado quando o paciente informa só o período do dia
+DAY_PERIODS = {"manha": "08:00", "tarde": "14:00", "noite": "19:00"}
+
+# Coleta de métricas de latência (False desliga a instrumentação, sem custo nos handlers)
+METRICS_ENABLED = True
+
+# Endereço e porta do endpoint /metrics no formato de texto do Prometheus (porta 0 para desligar)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Intervalo (em segundos) para gravar as métricas no log (0 para desligar)
+METRICS_DUMP_INTERVAL = 0
+
+# Registra no log (nível DEBUG) a duração de cada etapa com o ID do update que a originou
+METRICS_TRACE_IDS = False
+
+# Nível mínimo das mensagens de log
+LOG_LEVEL = "INFO"
+
+# Formato do log: "json" (produção), "text" (colorido se a saída for um terminal) ou "auto"
+# ("text" em terminais e "json" quando a saída é redirecionada, ex.: systemd ou docker)
+LOG_FORMAT = "auto"
+
+# Quantidade máxima de caracteres dos prompts e respostas do modelo incluídos no log
+LOG_BODY_MAX_CHARS = 200
+
+# Fração (0 a 1) das gerações que têm o prompt e a resposta registrados no log
+LOG_BODY_SAMPLE_RATE = 1.0
+
+# Modo de recebimento das mensagens: "polling" (um processo) ou "webhook" (servidor HTTP e
+# WEBHOOK_WORKERS processos, cada um com a sua cópia do modelo na memória)
+BOT_MODE = "polling"
+
+# Endereço, porta e caminho do servidor HTTP que recebe os updates do Telegram
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/telegram"
+
+# URL pública (HTTPS) registrada no Telegram, ex.: "https://bot.exemplo.com.br/telegram"
+# (None para não registrar, ex.: atrás de um proxy já configurado ou em testes locais)
+WEBHOOK_URL = None
+
+# Segredo enviado pelo Telegram no cabeçalho X-Telegram-Bot-Api-Secret-Token (None para não verificar)
+WEBHOOK_SECRET_TOKEN = None
+
+# Quantidade de processos que atendem as conversas (cada chat é sempre atendido pelo mesmo)
+WEBHOOK_WORKERS = 2
+
+# Updates aguardando por processo; com a fila cheia o servidor responde 503 e o Telegram reenvia
+WEBHOOK_QUEUE_SIZE = 1000
+
+# Arquivo SQLite com o estado das conversas (ex.: paciente aguardando informar a nova data) e o
+# chat_data, restaurados ao reiniciar o bot (None para manter apenas em memória)
+CONVERSATION_STORE_PATH = "conversations.sqlite3"
+
+# Intervalo (em segundos) em que as alterações de estado são entregues ao armazenamento
+CONVERSATION_SAVE_INTERVAL = 2
+
+# Espera (em segundos) para juntar as alterações em uma única gravação
+CONVERSATION_WRITE_DELAY = 0.5
+
+# Tempo (em segundos) sem resposta do paciente até a conversa ser encerrada e descartada
+CONVERSATION_TIMEOUT = 1800
+
+# Tempo (em segundos) sem atividade até o chat_data de um chat ser descartado
+CHAT_DATA_TTL = 86400
+
+# Intervalo (em segundos) da limpeza das conversas e chats inativos
+CONVERSATION_CLEANUP_INTERVAL = 600
+
+# Espera (em segundos) após a última mensagem de um chat para tratar as mensagens seguidas
+# como um único turno (0 para tratar cada mensagem separadamente)
+COALESCE_WINDOW = 1.0
+
+# Espera máxima (em segundos) desde a primeira mensagem do turno
+COALESCE_MAX_WAIT = 3.0
+
+# Mensagens aguardando por chat; acima disso as novas são descartadas
+COALESCE_MAX_MESSAGES = 5
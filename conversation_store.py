@@ -0,0 +1,267 @@
+import abc
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from telegram.ext import BasePersistence, PersistenceInput
+from config import (CONVERSATION_STORE_PATH, CONVERSATION_SAVE_INTERVAL, CONVERSATION_WRITE_DELAY,
+                    CONVERSATION_TIMEOUT, CHAT_DATA_TTL)
+
+
+class ConversationStore(abc.ABC):
+    """Interface dos armazenamentos usados por StatePersistence.
+
+    Os métodos são síncronos e chamados fora do event loop (asyncio.to_thread).
+    Chaves de conversa são tuplas (ex.: (chat_id, user_id)); estados e dados são objetos picklable.
+    """
+
+    @abc.abstractmethod
+    def load_conversations(self, name, max_age=None):
+        """{chave: estado} da conversa `name`, ignorando as alteradas há mais de `max_age` segundos."""
+
+    @abc.abstractmethod
+    def load_chat_data(self, max_age=None):
+        """{chat_id: dados} dos chats alterados nos últimos `max_age` segundos."""
+
+    @abc.abstractmethod
+    def write(self, conversations, chat_data):
+        """Grava de uma vez {(nome, chave): estado} e {chat_id: dados}; None remove a entrada."""
+
+    @abc.abstractmethod
+    def delete_stale(self, conversation_max_age, chat_data_max_age):
+        """Remove conversas e dados de chats antigos; retorna a quantidade de linhas removidas."""
+
+    def close(self):
+        pass
+
+
+# Armazenamento em um arquivo SQLite local (WAL), que pode ser compartilhado pelos processos do webhook
+class SQLiteConversationStore(ConversationStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT NOT NULL,
+            conversation_key TEXT NOT NULL,
+            state BLOB NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (name, conversation_key)
+        );
+        CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at);
+        CREATE TABLE IF NOT EXISTS chat_data (
+            chat_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS chat_data_updated_at ON chat_data (updated_at);
+    """
+
+    def __init__(self, path=CONVERSATION_STORE_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _get_connection(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(self.SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def _cutoff(max_age):
+        return time.time() - max_age if max_age else 0
+
+    def load_conversations(self, name, max_age=None):
+        with self._lock:
+            rows = self._get_connection().execute(
+                "SELECT conversation_key, state FROM conversations WHERE name = ? AND updated_at >= ?",
+                (name, self._cutoff(max_age))).fetchall()
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    def load_chat_data(self, max_age=None):
+        with self._lock:
+            rows = self._get_connection().execute(
+                "SELECT chat_id, data FROM chat_data WHERE updated_at >= ?", (self._cutoff(max_age),)).fetchall()
+        return {chat_id: pickle.loads(data) for chat_id, data in rows}
+
+    def write(self, conversations, chat_data):
+        now = time.time()
+        conversation_rows, conversation_deletes = [], []
+        for (name, key), state in conversations.items():
+            key = json.dumps(list(key))
+            if state is None:
+                conversation_deletes.append((name, key))
+            else:
+                conversation_rows.append((name, key, pickle.dumps(state), now))
+        chat_rows = [(chat_id, pickle.dumps(data), now) for chat_id, data in chat_data.items() if data is not None]
+        chat_deletes = [(chat_id,) for chat_id, data in chat_data.items() if data is None]
+
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO conversations (name, conversation_key, state, updated_at) "
+                    "VALUES (?, ?, ?, ?)", conversation_rows)
+                connection.executemany(
+                    "DELETE FROM conversations WHERE name = ? AND conversation_key = ?", conversation_deletes)
+                connection.executemany(
+                    "INSERT OR REPLACE INTO chat_data (chat_id, data, updated_at) VALUES (?, ?, ?)", chat_rows)
+                connection.executemany("DELETE FROM chat_data WHERE chat_id = ?", chat_deletes)
+
+    def delete_stale(self, conversation_max_age, chat_data_max_age):
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                removed = 0
+                if conversation_max_age:
+                    removed += connection.execute("DELETE FROM conversations WHERE updated_at < ?",
+                                                  (self._cutoff(conversation_max_age),)).rowcount
+                if chat_data_max_age:
+                    removed += connection.execute("DELETE FROM chat_data WHERE updated_at < ?",
+                                                  (self._cutoff(chat_data_max_age),)).rowcount
+        return removed
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class StatePersistence(BasePersistence):
+    """Persistência do python-telegram-bot para os estados das conversas e o chat_data.
+
+    O Application entrega as alterações a cada `update_interval` segundos; elas ficam em um buffer
+    e são gravadas juntas, em uma única transação, `write_delay` segundos depois da última.
+    Na inicialização tudo é lido com uma consulta por tabela, sem as conversas já expiradas.
+    """
+
+    def __init__(self, store=None, update_interval=CONVERSATION_SAVE_INTERVAL, write_delay=CONVERSATION_WRITE_DELAY,
+                 conversation_timeout=CONVERSATION_TIMEOUT, chat_data_ttl=CHAT_DATA_TTL):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=False,
+                                                     callback_data=False),
+                         update_interval=update_interval)
+        self.store = store or SQLiteConversationStore()
+        self.write_delay = write_delay
+        self.conversation_timeout = conversation_timeout
+        self.chat_data_ttl = chat_data_ttl
+        self._pending_conversations = {}
+        self._pending_chat_data = {}
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+        # chat_id -> última alteração do chat_data, para descartar da memória os chats inativos
+        self._chat_seen = {}
+        self.writes = 0
+
+    # Leitura inicial
+    async def get_conversations(self, name):
+        return await asyncio.to_thread(self.store.load_conversations, name, self.conversation_timeout)
+
+    async def get_chat_data(self):
+        chat_data = await asyncio.to_thread(self.store.load_chat_data, self.chat_data_ttl)
+        now = time.monotonic()
+        self._chat_seen.update((chat_id, now) for chat_id in chat_data)
+        return chat_data
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # Alterações: ficam no buffer até a próxima gravação
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, key)] = new_state
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id, data):
+        self._pending_chat_data[chat_id] = data
+        self._chat_seen[chat_id] = time.monotonic()
+        self._schedule_flush()
+
+    async def drop_chat_data(self, chat_id):
+        self._pending_chat_data[chat_id] = None
+        self._chat_seen.pop(chat_id, None)
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.write_delay)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        async with self._write_lock:
+            if not self._pending_conversations and not self._pending_chat_data:
+                return
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            chat_data, self._pending_chat_data = self._pending_chat_data, {}
+            try:
+                await asyncio.to_thread(self.store.write, conversations, chat_data)
+                self.writes += 1
+            except (sqlite3.Error, OSError, pickle.PicklingError) as e:
+                logging.error("Erro ao gravar o estado das conversas: %s", e)
+                # Mantém as alterações mais novas que chegaram durante a gravação
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                self._pending_chat_data = {**chat_data, **self._pending_chat_data}
+
+    async def flush(self):
+        """Chamado pelo Application ao encerrar: grava o que restou e fecha o armazenamento."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_pending()
+        await asyncio.to_thread(self.store.close)
+
+    def inactive_chats(self):
+        """Chats sem alteração no chat_data há mais de `chat_data_ttl` segundos."""
+        if not self.chat_data_ttl:
+            return []
+        cutoff = time.monotonic() - self.chat_data_ttl
+        return [chat_id for chat_id, seen in self._chat_seen.items() if seen < cutoff]
+
+    async def cleanup(self, application):
+        """Remove do armazenamento as conversas expiradas e libera da memória os chats inativos."""
+        for chat_id in self.inactive_chats():
+            application.drop_chat_data(chat_id)
+            self._chat_seen.pop(chat_id, None)
+        removed = await asyncio.to_thread(self.store.delete_stale, self.conversation_timeout, self.chat_data_ttl)
+        if removed:
+            logging.info("Estado de conversas: %d entradas antigas removidas", removed)
+
+    def stats(self):
+        return {
+            "pending_conversations": len(self._pending_conversations),
+            "pending_chat_data": len(self._pending_chat_data),
+            "tracked_chats": len(self._chat_seen),
+            "writes": self.writes,
+        }
@@ -0,0 +1,177 @@
+import datetime
+import functools
+import re
+import unicodedata
+from collections import namedtuple
+import pytz
+from config import DATE_PARSER_CACHE_SIZE, DAY_PERIODS
+
+
+# Fuso horário de Brasília
+BRAZIL_TZ = pytz.timezone("America/Sao_Paulo")
+
+# Resultado da interpretação: data (YYYY-MM-DD), hora (HH:MM:SS ou None) e origem da hora
+# ("explicito" quando o paciente disse a hora, "periodo" para manhã/tarde/noite, None se não informou)
+ParsedDateTime = namedtuple("ParsedDateTime", "date time time_source")
+
+WEEKDAYS = {"segunda": 0, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4, "sabado": 5, "domingo": 6}
+
+NUMBERS = {"um": 1, "uma": 1, "dois": 2, "duas": 2, "tres": 3, "quatro": 4, "cinco": 5,
+           "seis": 6, "sete": 7, "oito": 8, "nove": 9, "dez": 10, "quinze": 15}
+
+_NUMBER = r"(\d+|" + "|".join(NUMBERS) + r")"
+
+# Padrões de data (verificados nesta ordem; o primeiro que casar define a data)
+_FULL_DATE = re.compile(r"\b(\d{1,2})[/.-](\d{1,2})(?:[/.-](\d{2,4}))?\b")
+_DAY_OF_MONTH = re.compile(r"\bdia (\d{1,2})\b")
+_DAY_AFTER_TOMORROW = re.compile(r"\bdepois de amanha\b")
+_TOMORROW = re.compile(r"\bamanha\b")
+_TODAY = re.compile(r"\bhoje\b")
+_IN_DAYS = re.compile(r"\b(?:daqui a|daqui|em|dentro de) " + _NUMBER + r" (dias?|semanas?)\b")
+_NEXT_WEEK = re.compile(r"\b(?:semana que vem|proxima semana)\b")
+_WEEKDAY = re.compile(r"\b(?:(proxima) )?(" + "|".join(WEEKDAYS) + r")(?:[- ]feira)?(?: (que vem|da semana que vem))?\b")
+
+# Padrões de hora
+_HOUR_MINUTE = re.compile(r"\b(\d{1,2}):(\d{2})(?::\d{2})?\b")
+_HOUR_SUFFIX = re.compile(r"\b(\d{1,2}) ?(?:h|hs|hrs|horas?)(?: ?(\d{2}))?(?: ?(?:min|minutos))?\b")
+_AT_HOUR = re.compile(r"\b(?:as|a partir das|pelas) (\d{1,2})\b")
+_HOUR_OF_PERIOD = re.compile(r"\b(\d{1,2}) (?:da|de) (?:manha|tarde|noite)\b")
+_NOON = re.compile(r"\bmeio[- ]dia(?: e meia)?\b")
+_PERIOD = re.compile(r"\b(?:de |a |pela |na |no )?(manha|tarde|noite)\b")
+
+_SPACES = re.compile(r"\s+")
+
+
+# Minúsculo, sem acentos e sem espaços repetidos
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _SPACES.sub(" ", text).strip()
+
+
+def _number(value):
+    return int(value) if value.isdigit() else NUMBERS[value]
+
+
+def _valid_date(year, month, day):
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+# Interpreta a data; retorna (data, texto restante sem o trecho da data)
+def _parse_date(text, today):
+    match = _FULL_DATE.search(text)
+    if match:
+        day, month, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        if year:
+            year = int(year) + (2000 if len(year) == 2 else 0)
+            return _valid_date(year, month, day), _cut(text, match)
+        # Sem ano: este ano, ou o próximo se a data já passou
+        date = _valid_date(today.year, month, day)
+        if date is not None and date < today:
+            date = _valid_date(today.year + 1, month, day)
+        return date, _cut(text, match)
+
+    match = _DAY_OF_MONTH.search(text)
+    if match:
+        day = int(match.group(1))
+        date = _valid_date(today.year, today.month, day)
+        if date is None or date < today:
+            next_month = (today.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+            date = _valid_date(next_month.year, next_month.month, day)
+        return date, _cut(text, match)
+
+    for pattern, days in ((_DAY_AFTER_TOMORROW, 2), (_TOMORROW, 1), (_TODAY, 0)):
+        match = pattern.search(text)
+        if match:
+            return today + datetime.timedelta(days=days), _cut(text, match)
+
+    match = _IN_DAYS.search(text)
+    if match:
+        amount = _number(match.group(1))
+        days = amount * 7 if match.group(2).startswith("semana") else amount
+        return today + datetime.timedelta(days=days), _cut(text, match)
+
+    match = _WEEKDAY.search(text)
+    if match:
+        # Próxima ocorrência do dia da semana, sempre depois de hoje
+        ahead = (WEEKDAYS[match.group(2)] - today.weekday() - 1) % 7 + 1
+        if match.group(3) == "da semana que vem":
+            # "sexta da semana que vem": o dia na semana seguinte à atual
+            start_of_next_week = today + datetime.timedelta(days=7 - today.weekday())
+            return start_of_next_week + datetime.timedelta(days=WEEKDAYS[match.group(2)]), _cut(text, match)
+        return today + datetime.timedelta(days=ahead), _cut(text, match)
+
+    match = _NEXT_WEEK.search(text)
+    if match:
+        return today + datetime.timedelta(days=7), _cut(text, match)
+
+    return None, text
+
+
+# Interpreta a hora; retorna (datetime.time ou None, origem)
+def _parse_time(text):
+    period = _PERIOD.search(text)
+    period = period.group(1) if period else None
+
+    hour = minute = None
+    match = (_HOUR_MINUTE.search(text) or _HOUR_SUFFIX.search(text) or _AT_HOUR.search(text)
+             or _HOUR_OF_PERIOD.search(text))
+    if match:
+        groups = match.groups()
+        hour, minute = int(groups[0]), int(groups[1] or 0) if len(groups) > 1 else 0
+    elif _NOON.search(text):
+        hour, minute = 12, 30 if "meia" in _NOON.search(text).group(0) else 0
+
+    if hour is not None:
+        # "3 da tarde" = 15h
+        if period in ("tarde", "noite") and hour < 12:
+            hour += 12
+        if hour > 23 or minute > 59:
+            return None, None
+        return datetime.time(hour, minute), "explicito"
+
+    if period is not None:
+        return datetime.time.fromisoformat(DAY_PERIODS[period]), "periodo"
+    return None, None
+
+
+def _cut(text, match):
+    return text[:match.start()] + " " + text[match.end():]
+
+
+# Último recurso: dateutil com fuzzy=True (lento); a hora só conta se o texto a informou
+def _parse_with_dateutil(text, today):
+    from dateutil import parser
+
+    try:
+        first = parser.parse(text, dayfirst=True, fuzzy=True,
+                             default=datetime.datetime.combine(today, datetime.time(0, 0)))
+        second = parser.parse(text, dayfirst=True, fuzzy=True,
+                              default=datetime.datetime.combine(today, datetime.time(1, 1)))
+    except (ValueError, OverflowError):
+        return None
+    time_given = first.time() == second.time()
+    return ParsedDateTime(first.strftime('%Y-%m-%d'),
+                          first.strftime('%H:%M:%S') if time_given else None,
+                          "explicito" if time_given else None)
+
+
+@functools.lru_cache(maxsize=DATE_PARSER_CACHE_SIZE)
+def _parse_normalized(text, today):
+    date, rest = _parse_date(text, today)
+    if date is None:
+        return _parse_with_dateutil(text, today)
+    time, time_source = _parse_time(rest)
+    return ParsedDateTime(date.strftime('%Y-%m-%d'), time.strftime('%H:%M:%S') if time else None, time_source)
+
+
+# Interpreta expressões de data e hora em português ("segunda que vem às 15h", "amanhã à tarde", "25/12 15:30")
+def parse(text, today=None):
+    """Retorna um ParsedDateTime, ou None se não encontrar uma data."""
+    if today is None:
+        today = datetime.datetime.now(BRAZIL_TZ).date()
+    # O cache usa o texto normalizado e o dia atual (expressões relativas mudam de um dia para outro)
+    return _parse_normalized(normalize(text), today)
@@ -1,7 +1,14 @@
 import mysql.connector
 from mysql.connector import Error
 import datetime
+import queue
+import threading
+import time
 import pytz
+from config import (DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING,
+                    RESCHEDULE_ALTERNATIVES, RESCHEDULE_SEARCH_DAYS)
+from slot_index import free_slots, slot_status, LIVRE
+import metrics
 
 
 # Fuso horário de Brasília (GMT-3)
@@ -11,12 +18,12 @@ BRAZIL_TZ = pytz.timezone("America/Sao_Paulo")
 def create_connection():
     """Estabelece a conexão com o banco de dados MySQL"""
     try:
-    connection = mysql.connector.connect(
-        host="<endereço_host>",
-        user="<usuario>",
-        password="<senha>",
-        database="<nome_do_banco>"
-    	)
+        connection = mysql.connector.connect(
+            host=DB_HOST,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            database=DB_NAME
+        )
         if connection.is_connected():
             print("Conexão ao banco de dados MySQL estabelecida com sucesso")
         return connection
@@ -24,10 +31,145 @@ def create_connection():
         print(f"Erro ao conectar ao MySQL: {e}")
         return None
 
+
+# Conexão emprestada do pool: close() devolve a conexão ao pool em vez de fechá-la
+class PooledConnection:
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        if self._connection is not None:
+            self._pool.release(self._connection)
+            self._connection = None
+
+
+# Pool de conexões reaproveitadas entre as consultas
+class ConnectionPool:
+    """Mantém até `size` conexões abertas com o MySQL e as empresta para cada consulta."""
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, pre_ping=DB_POOL_PRE_PING,
+                 connect=create_connection):
+        self.size = size
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        # Limita o total de conexões (ociosas + em uso) ao tamanho do pool
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.created = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def acquire(self, timeout=None):
+        """Empresta uma conexão; retorna None se o pool estiver esgotado após `timeout` segundos."""
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(blocking=False):
+            start = time.perf_counter()
+            acquired = self._slots.acquire(timeout=timeout)
+            with self._lock:
+                self.waits += 1
+                self.wait_time += time.perf_counter() - start
+                if not acquired:
+                    self.timeouts += 1
+            if not acquired:
+                print(f"Tempo esgotado aguardando conexão do pool ({timeout}s)")
+                return None
+
+        connection = self._take_idle()
+        if connection is None:
+            connection = self._connect()
+            if connection is None:
+                self._slots.release()
+                return None
+            with self._lock:
+                self.created += 1
+
+        with self._lock:
+            self.in_use += 1
+        return PooledConnection(self, connection)
+
+    def _take_idle(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if not self.pre_ping:
+                return connection
+            try:
+                # Verifica se a conexão ociosa ainda está viva antes de usá-la
+                connection.ping(reconnect=True, attempts=1, delay=0)
+                return connection
+            except Error:
+                self._discard(connection)
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def release(self, connection):
+        with self._lock:
+            self.in_use -= 1
+        try:
+            # Encerra transações abertas para que a próxima consulta não leia um snapshot antigo
+            if connection.is_connected():
+                if connection.in_transaction:
+                    connection.rollback()
+                self._idle.put(connection)
+            else:
+                self._discard(connection)
+        except Error:
+            self._discard(connection)
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "in_use": self.in_use,
+            "idle": self._idle.qsize(),
+            "created": self.created,
+            "waits": self.waits,
+            "wait_time": self.wait_time,
+            "timeouts": self.timeouts,
+        }
+
+
+# Pool compartilhado por todas as funções deste módulo
+connection_pool = ConnectionPool()
+
+
+# Empresta uma conexão do pool (devolvida ao chamar connection.close())
+def get_connection():
+    return connection_pool.acquire()
+
+
+# Registra a duração de cada chamada em metrics.DB_QUERY_SECONDS
+def _timed(func):
+    return metrics.timed(metrics.DB_QUERY_SECONDS, function=func.__name__, api="sync")(func)
+
+
 # Função para obter compromissos nas próximas 24 horas e que ainda não receberam lembretes
+@_timed
 def get_appointments_in_next_24_hours():
     """Recupera compromissos marcados nas próximas 24 horas que ainda não receberam lembrete"""
-    connection = create_connection()
+    connection = get_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
@@ -52,9 +194,10 @@ def get_appointments_in_next_24_hours():
     return []
 
 # Função para armazenar diálogo no banco de dados
+@_timed
 def save_dialogue(telegram_id, user_message, bot_response):
     """Armazena o diálogo no banco de dados"""
-    connection = create_connection()
+    connection = get_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
@@ -71,8 +214,9 @@ def save_dialogue(telegram_id, user_message, bot_response):
             connection.close()
 
 # Apaga um compromisso do banco de dados
+@_timed
 def delete_appointment(appointment_id):
-    connection = create_connection()
+    connection = get_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
@@ -86,8 +230,9 @@ def delete_appointment(appointment_id):
             connection.close()
 
 # Verifica se há disponibilidade para um novo compromisso
+@_timed
 def check_availability(date, time):
-    connection = create_connection()
+    connection = get_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
@@ -106,8 +251,9 @@ def check_availability(date, time):
     return False
 
 # Adiciona um novo compromisso ao banco de dados
+@_timed
 def add_appointment(patient_id, date, time):
-    connection = create_connection()
+    connection = get_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
@@ -124,8 +270,9 @@ def add_appointment(patient_id, date, time):
             connection.close()
 
 # Encontra o próximo horário disponível em uma data específica
+@_timed
 def find_next_available_time(date):
-    connection = create_connection()
+    connection = get_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
@@ -135,13 +282,14 @@ def find_next_available_time(date):
                 ORDER BY appointment_time ASC
             """
             cursor.execute(query, (date,))
-            occupied_times = cursor.fetchall()
+            # O MySQL retorna TIME como timedelta; compara no mesmo formato "HH:MM:SS" da lista de horários
+            occupied_times = {format_time_value(row[0]) for row in cursor.fetchall()}
 
             # Supondo que o horário de trabalho seja das 08:00 às 18:00
             available_times = generate_working_hours()
 
             for time in available_times:
-                if (time,) not in occupied_times:
+                if time not in occupied_times:
                     return time
 
             return None  # Não há horários disponíveis
@@ -152,6 +300,17 @@ def find_next_available_time(date):
             connection.close()
     return None
 
+# Converte um horário (timedelta do MySQL, datetime.time ou texto) para o formato HH:MM:SS
+def format_time_value(value):
+    if isinstance(value, datetime.timedelta):
+        total_seconds = int(value.total_seconds())
+        hours, remainder = divmod(total_seconds, 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    if isinstance(value, datetime.time):
+        return value.strftime('%H:%M:%S')
+    return str(value)
+
 # Gera os horários de trabalho (por exemplo, das 08:00 às 18:00
 def generate_working_hours():
     working_hours = []
@@ -160,8 +319,9 @@ def generate_working_hours():
     return working_hours
 
 # Busca o patient_id baseado no telegram_id do usuário
+@_timed
 def get_patient_by_telegram_id(telegram_id):
-    connection = create_connection()
+    connection = get_connection()
     if connection is None:
         print("Conexão com o banco de dados falhou.")
         return None
@@ -184,8 +344,9 @@ def get_patient_by_telegram_id(telegram_id):
     return None
 
 # Busca o compromisso baseado no telegram_id do usuário
+@_timed
 def get_appointment_by_telegram_id(telegram_id):
-    connection = create_connection()
+    connection = get_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
@@ -214,8 +375,9 @@ def get_appointment_by_telegram_id(telegram_id):
     return None
 
 # Busca o compromisso baseado no patient_id do usuário
+@_timed
 def get_appointment_by_patient_id(patient_id):
-    connection = create_connection()
+    connection = get_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
@@ -240,8 +402,9 @@ def get_appointment_by_patient_id(patient_id):
     return None
 
 # Marca o lembrete como enviado para um compromisso
+@_timed
 def mark_reminder_sent(appointment_id):
-    connection = create_connection()
+    connection = get_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
@@ -252,4 +415,123 @@ def mark_reminder_sent(appointment_id):
             print(f"Erro ao marcar lembrete como enviado: {e}")
         finally:
             cursor.close()
-            connection.close()
\ No newline at end of file
+            connection.close()
+
+
+# Marca o lembrete como enviado para vários compromissos em uma única instrução
+@_timed
+def mark_reminders_sent(appointment_ids):
+    if not appointment_ids:
+        return
+    connection = get_connection()
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            placeholders = ", ".join(["%s"] * len(appointment_ids))
+            query = f"UPDATE appointments SET reminder_sent = TRUE WHERE appointment_id IN ({placeholders})"
+            cursor.execute(query, tuple(appointment_ids))
+            connection.commit()
+        except Error as e:
+            print(f"Erro ao marcar lembretes como enviados: {e}")
+        finally:
+            cursor.close()
+            connection.close()
+
+# Consultas usadas por reschedule_appointment (também em db_async)
+RESCHEDULE_LOCK_APPOINTMENT_QUERY = """
+    SELECT a.appointment_id, a.appointment_date, a.appointment_time, a.patient_id
+    FROM appointments a
+    JOIN patients p ON a.patient_id = p.patient_id
+    WHERE p.telegram_id = %s
+    LIMIT 1
+    FOR UPDATE
+"""
+RESCHEDULE_LOCK_DAY_QUERY = """
+    SELECT appointment_id, appointment_date, appointment_time FROM appointments
+    WHERE appointment_date = %s
+    FOR UPDATE
+"""
+RESCHEDULE_MOVE_QUERY = """
+    UPDATE appointments
+    SET appointment_date = %s, appointment_time = %s, reminder_sent = FALSE
+    WHERE appointment_id = %s
+"""
+RESCHEDULE_OCCUPIED_QUERY = """
+    SELECT appointment_id, appointment_date, appointment_time
+    FROM appointments
+    WHERE appointment_date BETWEEN %s AND %s
+"""
+
+
+# Intervalo de datas (início, fim) pesquisado pelas alternativas de remarcação
+def reschedule_search_range(new_date, search_days):
+    start = datetime.date.fromisoformat(str(new_date))
+    return str(start), str(start + datetime.timedelta(days=search_days - 1))
+
+
+# Remarca o compromisso do paciente em uma única transação
+@_timed
+def reschedule_appointment(telegram_id, new_date, new_time=None,
+                           alternatives=RESCHEDULE_ALTERNATIVES, search_days=RESCHEDULE_SEARCH_DAYS):
+    """Busca o compromisso, trava o horário pedido e move o compromisso em uma única transação.
+
+    Retorna um dicionário com "status":
+      - "sem_compromisso": o paciente não tem compromisso;
+      - "remarcada": com "appointment" (novo) e "previous" (anterior);
+      - "ocupado" (o slot do horário pedido já tem compromisso) ou "fora_do_expediente":
+        com "alternatives", os próximos horários livres [(data, hora)].
+    Retorna None se houver erro de banco. Sem new_time, mantém o horário original.
+    """
+    connection = get_connection()
+    if connection is None:
+        return None
+    cursor = None
+    try:
+        connection.start_transaction()
+        cursor = connection.cursor()
+
+        # Trava a linha do compromisso do paciente
+        cursor.execute(RESCHEDULE_LOCK_APPOINTMENT_QUERY, (telegram_id,))
+        previous = cursor.fetchone()
+        if previous is None:
+            connection.rollback()
+            return {"status": "sem_compromisso"}
+        appointment_id, original_date, original_time, patient_id = previous
+        if new_time is None:
+            new_time = format_time_value(original_time)
+
+        # Trava os compromissos do dia pedido (o índice por data também bloqueia inserções
+        # concorrentes no dia) e verifica o expediente e o slot do horário
+        cursor.execute(RESCHEDULE_LOCK_DAY_QUERY, (new_date,))
+        status = slot_status(cursor.fetchall(), new_date, new_time, ignore_id=appointment_id)
+        if status != LIVRE:
+            cursor.execute(RESCHEDULE_OCCUPIED_QUERY, reschedule_search_range(new_date, search_days))
+            rows = cursor.fetchall()
+            connection.rollback()
+            return {"status": status,
+                    "alternatives": free_slots(rows, new_date, new_time, alternatives, search_days)}
+
+        cursor.execute(RESCHEDULE_MOVE_QUERY, (new_date, new_time, appointment_id))
+        connection.commit()
+        return {"status": "remarcada",
+                "appointment": (appointment_id, new_date, new_time, patient_id),
+                "previous": previous}
+
+    except mysql.connector.IntegrityError:
+        # A restrição de horário único foi violada por uma remarcação concorrente
+        connection.rollback()
+        try:
+            cursor.execute(RESCHEDULE_OCCUPIED_QUERY, reschedule_search_range(new_date, search_days))
+            rows = cursor.fetchall()
+            return {"status": "ocupado",
+                    "alternatives": free_slots(rows, new_date, new_time, alternatives, search_days)}
+        except Error as e:
+            print(f"Erro ao buscar horários alternativos: {e}")
+    except Error as e:
+        print(f"Erro ao remarcar compromisso: {e}")
+        connection.rollback()
+    finally:
+        if cursor is not None:
+            cursor.close()
+        connection.close()
+    return None
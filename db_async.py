@@ -0,0 +1,552 @@
+import asyncio
+import contextlib
+import datetime
+import logging
+import pytz
+from config import (DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_POOL_SIZE, DB_POOL_TIMEOUT,
+                    DB_ASYNC_DRIVER, DB_SQLITE_PATH, RESCHEDULE_ALTERNATIVES, RESCHEDULE_SEARCH_DAYS)
+from db import (generate_working_hours, format_time_value,
+                RESCHEDULE_LOCK_APPOINTMENT_QUERY, RESCHEDULE_LOCK_DAY_QUERY, RESCHEDULE_MOVE_QUERY)
+from slot_index import SlotIndex, slot_status, LIVRE, OCUPADO
+import metrics
+
+
+# Fuso horário de Brasília (GMT-3)
+BRAZIL_TZ = pytz.timezone("America/Sao_Paulo")
+
+
+# Backend assíncrono para MySQL (aiomysql), com pool próprio
+class MySQLBackend:
+    def __init__(self, host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME,
+                 size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        import aiomysql
+        import pymysql
+
+        self._aiomysql = aiomysql
+        self.Error = pymysql.Error
+        self.IntegrityError = pymysql.IntegrityError
+        self._OperationalError = pymysql.OperationalError
+        self._params = dict(host=host, user=user, password=password, db=database,
+                            maxsize=size, connect_timeout=timeout, autocommit=True, pool_recycle=3600)
+        self.timeout = timeout
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self):
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await self._aiomysql.create_pool(**self._params)
+        return self._pool
+
+    async def _acquire(self, pool):
+        # Pool esgotado vira self.Error, tratado pelo repositório como as demais falhas de banco
+        # (a API síncrona retorna None/[] na mesma situação)
+        try:
+            return await asyncio.wait_for(pool.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._OperationalError(f"Tempo esgotado aguardando conexão do pool ({self.timeout}s)") from None
+
+    async def _run(self, query, params, fetch):
+        pool = await self._get_pool()
+        connection = await self._acquire(pool)
+        try:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, params)
+                if fetch == "one":
+                    return await cursor.fetchone()
+                if fetch == "all":
+                    return await cursor.fetchall()
+                if fetch == "insert":
+                    return cursor.lastrowid
+                return cursor.rowcount
+        finally:
+            pool.release(connection)
+
+    async def fetchone(self, query, params=()):
+        return await self._run(query, params, "one")
+
+    async def fetchall(self, query, params=()):
+        return await self._run(query, params, "all")
+
+    async def execute(self, query, params=()):
+        return await self._run(query, params, "execute")
+
+    async def insert(self, query, params=()):
+        return await self._run(query, params, "insert")
+
+    async def executemany(self, query, rows):
+        pool = await self._get_pool()
+        connection = await self._acquire(pool)
+        try:
+            async with connection.cursor() as cursor:
+                await cursor.executemany(query, rows)
+                return cursor.rowcount
+        finally:
+            pool.release(connection)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """Executa as consultas do bloco em uma única transação, na mesma conexão."""
+        pool = await self._get_pool()
+        connection = await self._acquire(pool)
+        try:
+            await connection.begin()
+            async with connection.cursor() as cursor:
+                yield _MySQLTransaction(cursor)
+            await connection.commit()
+        except BaseException:
+            await connection.rollback()
+            raise
+        finally:
+            pool.release(connection)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+
+# Backend assíncrono para SQLite (aiosqlite), usado em testes e desenvolvimento local
+class SQLiteBackend:
+    def __init__(self, path=DB_SQLITE_PATH):
+        import sqlite3
+
+        self.Error = sqlite3.Error
+        self.IntegrityError = sqlite3.IntegrityError
+        self.path = path
+        self._connection = None
+        # O SQLite aceita um único escritor: as consultas são serializadas na mesma conexão
+        self._lock = asyncio.Lock()
+
+    async def _get_connection(self):
+        if self._connection is None:
+            import aiosqlite
+            import sqlite3
+            # Converte colunas DATE em datetime.date, como o driver do MySQL
+            self._connection = await aiosqlite.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)
+        return self._connection
+
+    async def _run(self, query, params, fetch):
+        # As consultas são escritas com o placeholder do MySQL (%s)
+        query = query.replace("%s", "?")
+        async with self._lock:
+            connection = await self._get_connection()
+            cursor = await connection.execute(query, params)
+            try:
+                if fetch == "one":
+                    return await cursor.fetchone()
+                if fetch == "all":
+                    return await cursor.fetchall()
+                await connection.commit()
+                return cursor.lastrowid if fetch == "insert" else cursor.rowcount
+            finally:
+                await cursor.close()
+
+    async def fetchone(self, query, params=()):
+        return await self._run(query, params, "one")
+
+    async def fetchall(self, query, params=()):
+        return await self._run(query, params, "all")
+
+    async def execute(self, query, params=()):
+        return await self._run(query, params, "execute")
+
+    async def insert(self, query, params=()):
+        return await self._run(query, params, "insert")
+
+    async def executemany(self, query, rows):
+        async with self._lock:
+            connection = await self._get_connection()
+            await connection.executemany(query.replace("%s", "?"), rows)
+            await connection.commit()
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """Executa as consultas do bloco em uma única transação (BEGIN IMMEDIATE trava a escrita)."""
+        async with self._lock:
+            connection = await self._get_connection()
+            await connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield _SQLiteTransaction(connection)
+                await connection.commit()
+            except BaseException:
+                await connection.rollback()
+                raise
+
+    async def close(self):
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+
+# Consultas dentro de uma transação do MySQL
+class _MySQLTransaction:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def fetchone(self, query, params=()):
+        await self._cursor.execute(query, params)
+        return await self._cursor.fetchone()
+
+    async def fetchall(self, query, params=()):
+        await self._cursor.execute(query, params)
+        return await self._cursor.fetchall()
+
+    async def execute(self, query, params=()):
+        await self._cursor.execute(query, params)
+        return self._cursor.rowcount
+
+
+# Consultas dentro de uma transação do SQLite (sem FOR UPDATE: a transação já trava o banco)
+class _SQLiteTransaction:
+    def __init__(self, connection):
+        self._connection = connection
+
+    async def _run(self, query, params, fetch):
+        query = query.replace("FOR UPDATE", "").replace("%s", "?")
+        cursor = await self._connection.execute(query, params)
+        try:
+            if fetch == "one":
+                return await cursor.fetchone()
+            if fetch == "all":
+                return await cursor.fetchall()
+            return cursor.rowcount
+        finally:
+            await cursor.close()
+
+    async def fetchone(self, query, params=()):
+        return await self._run(query, params, "one")
+
+    async def fetchall(self, query, params=()):
+        return await self._run(query, params, "all")
+
+    async def execute(self, query, params=()):
+        return await self._run(query, params, "execute")
+
+
+# Cria o backend configurado em DB_ASYNC_DRIVER
+def create_backend(driver=DB_ASYNC_DRIVER):
+    if driver == "mysql":
+        return MySQLBackend()
+    if driver == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Driver de banco assíncrono desconhecido: {driver}")
+
+
+# Registra a duração de cada chamada em metrics.DB_QUERY_SECONDS
+def _timed(func):
+    return metrics.timed(metrics.DB_QUERY_SECONDS, function=func.__name__, api="async")(func)
+
+
+# Versão assíncrona das funções de db.py, para uso nos handlers do bot
+class AsyncRepository:
+    """Espelha a API síncrona de db.py sem bloquear o event loop."""
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._listeners = []
+        # Horários ocupados por dia, mantidos pelos avisos deste repositório (alternativas de remarcação)
+        self.slot_index = SlotIndex(self)
+
+    def add_listener(self, listener):
+        """Registra um objeto avisado das alterações de compromissos.
+
+        O listener pode implementar appointment_added(appointment_id, patient_id, date, time),
+        appointment_deleted(appointment_id) e reminders_sent(appointment_ids).
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, event, *args):
+        for listener in self._listeners:
+            callback = getattr(listener, event, None)
+            if callback is not None:
+                callback(*args)
+
+    @property
+    def backend(self):
+        # Criado sob demanda, para que o pool nasça dentro do event loop do bot
+        if self._backend is None:
+            self._backend = create_backend()
+        return self._backend
+
+    async def close(self):
+        if self._backend is not None:
+            await self._backend.close()
+
+    @_timed
+    async def get_appointments_in_next_24_hours(self):
+        """Recupera compromissos marcados nas próximas 24 horas que ainda não receberam lembrete"""
+        try:
+            next_24_hours = datetime.datetime.now(BRAZIL_TZ) + datetime.timedelta(hours=24)
+            query = """
+                SELECT a.appointment_id, a.appointment_date, a.appointment_time, p.name, p.telegram_id
+                FROM appointments a
+                JOIN patients p ON a.patient_id = p.patient_id
+                WHERE a.appointment_date = %s AND a.reminder_sent = FALSE
+            """
+            return await self.backend.fetchall(query, (next_24_hours.date(),))
+        except self.backend.Error as e:
+            logging.error("Erro ao buscar compromissos: %s", e)
+        return []
+
+    @_timed
+    async def save_dialogue(self, telegram_id, user_message, bot_response):
+        """Armazena o diálogo no banco de dados"""
+        try:
+            query = """
+                INSERT INTO dialogues (telegram_id, user_message, bot_response)
+                VALUES (%s, %s, %s)
+            """
+            await self.backend.execute(query, (telegram_id, user_message, bot_response))
+        except self.backend.Error as e:
+            logging.error("Erro ao salvar diálogo: %s", e)
+
+    @_timed
+    async def save_dialogues(self, rows):
+        """Armazena vários diálogos (telegram_id, user_message, bot_response) de uma vez; retorna True se gravou"""
+        try:
+            query = """
+                INSERT INTO dialogues (telegram_id, user_message, bot_response)
+                VALUES (%s, %s, %s)
+            """
+            await self.backend.executemany(query, rows)
+            return True
+        except self.backend.Error as e:
+            logging.error("Erro ao salvar diálogos: %s", e)
+        return False
+
+    @_timed
+    async def delete_appointment(self, appointment_id):
+        try:
+            query = "DELETE FROM appointments WHERE appointment_id = %s"
+            await self.backend.execute(query, (appointment_id,))
+            self._notify("appointment_deleted", appointment_id)
+        except self.backend.Error as e:
+            logging.error("Erro ao apagar compromisso: %s", e)
+
+    @_timed
+    async def check_availability(self, date, time):
+        try:
+            query = """
+                SELECT COUNT(*) FROM appointments
+                WHERE appointment_date = %s AND appointment_time = %s
+            """
+            result = await self.backend.fetchone(query, (date, time))
+            return result[0] == 0  # Retorna True se estiver disponível
+        except self.backend.Error as e:
+            logging.error("Erro ao verificar disponibilidade: %s", e)
+        return False
+
+    @_timed
+    async def add_appointment(self, patient_id, date, time):
+        """Adiciona o compromisso e retorna o appointment_id criado"""
+        try:
+            query = """
+                INSERT INTO appointments (patient_id, appointment_date, appointment_time)
+                VALUES (%s, %s, %s)
+            """
+            appointment_id = await self.backend.insert(query, (patient_id, date, time))
+            self._notify("appointment_added", appointment_id, patient_id, date, time)
+            return appointment_id
+        except self.backend.Error as e:
+            logging.error("Erro ao adicionar compromisso: %s", e)
+        return None
+
+    @_timed
+    async def find_next_available_time(self, date):
+        try:
+            query = """
+                SELECT appointment_time FROM appointments
+                WHERE appointment_date = %s
+                ORDER BY appointment_time ASC
+            """
+            occupied_times = {format_time_value(row[0]) for row in await self.backend.fetchall(query, (date,))}
+            for time in generate_working_hours():
+                if time not in occupied_times:
+                    return time
+            return None  # Não há horários disponíveis
+        except self.backend.Error as e:
+            logging.error("Erro ao encontrar próximo horário disponível: %s", e)
+        return None
+
+    @_timed
+    async def get_patient_by_telegram_id(self, telegram_id):
+        try:
+            query = "SELECT patient_id FROM patients WHERE telegram_id = %s"
+            return await self.backend.fetchone(query, (telegram_id,))
+        except self.backend.Error as e:
+            logging.error("Erro ao buscar patient_id: %s", e)
+        return None
+
+    @_timed
+    async def get_appointment_by_telegram_id(self, telegram_id):
+        try:
+            query = """
+            SELECT a.appointment_id, a.appointment_date, a.appointment_time, p.patient_id
+            FROM appointments a
+            JOIN patients p ON a.patient_id = p.patient_id
+            WHERE p.telegram_id = %s
+            """
+            return await self.backend.fetchone(query, (telegram_id,))
+        except self.backend.Error as e:
+            logging.error("Erro ao buscar compromisso: %s", e)
+        return None
+
+    @_timed
+    async def get_appointment_by_patient_id(self, patient_id):
+        try:
+            query = """
+            SELECT appointment_id, appointment_date, appointment_time, patient_id
+            FROM appointments
+            WHERE patient_id = %s
+            """
+            return await self.backend.fetchone(query, (patient_id,))
+        except self.backend.Error as e:
+            logging.error("Erro ao buscar compromisso: %s", e)
+        return None
+
+    @_timed
+    async def mark_reminder_sent(self, appointment_id):
+        try:
+            query = "UPDATE appointments SET reminder_sent = TRUE WHERE appointment_id = %s"
+            await self.backend.execute(query, (appointment_id,))
+            self._notify("reminders_sent", [appointment_id])
+        except self.backend.Error as e:
+            logging.error("Erro ao marcar lembrete como enviado: %s", e)
+
+    @_timed
+    async def mark_reminders_sent(self, appointment_ids):
+        """Marca vários lembretes como enviados em uma única instrução UPDATE ... IN (...)"""
+        if not appointment_ids:
+            return
+        try:
+            placeholders = ", ".join(["%s"] * len(appointment_ids))
+            query = f"UPDATE appointments SET reminder_sent = TRUE WHERE appointment_id IN ({placeholders})"
+            await self.backend.execute(query, tuple(appointment_ids))
+            self._notify("reminders_sent", appointment_ids)
+        except self.backend.Error as e:
+            logging.error("Erro ao marcar lembretes como enviados: %s", e)
+
+    @_timed
+    async def get_reminder_deadlines(self, start, end):
+        """Compromissos sem lembrete com data/hora no intervalo (start, end]"""
+        try:
+            query = """
+                SELECT appointment_id, appointment_date, appointment_time
+                FROM appointments
+                WHERE reminder_sent = FALSE AND appointment_at > %s AND appointment_at <= %s
+            """
+            return await self.backend.fetchall(query, (_format_datetime(start), _format_datetime(end)))
+        except self.backend.Error as e:
+            logging.error("Erro ao buscar prazos de lembretes: %s", e)
+        return []
+
+    @_timed
+    async def get_reminder_deadlines_after_id(self, appointment_id, start, end):
+        """Compromissos criados depois de `appointment_id` com data/hora no intervalo (start, end]"""
+        try:
+            query = """
+                SELECT appointment_id, appointment_date, appointment_time
+                FROM appointments
+                WHERE appointment_id > %s AND reminder_sent = FALSE
+                  AND appointment_at > %s AND appointment_at <= %s
+            """
+            params = (appointment_id, _format_datetime(start), _format_datetime(end))
+            return await self.backend.fetchall(query, params)
+        except self.backend.Error as e:
+            logging.error("Erro ao buscar prazos de lembretes: %s", e)
+        return []
+
+    @_timed
+    async def get_reminders_by_ids(self, appointment_ids):
+        """Dados para o lembrete dos compromissos informados que ainda não receberam lembrete.
+
+        Retorna None se houver erro de banco (os lembretes devem ser tentados de novo).
+        """
+        if not appointment_ids:
+            return []
+        try:
+            placeholders = ", ".join(["%s"] * len(appointment_ids))
+            query = f"""
+                SELECT a.appointment_id, a.appointment_date, a.appointment_time, p.name, p.telegram_id
+                FROM appointments a
+                JOIN patients p ON a.patient_id = p.patient_id
+                WHERE a.appointment_id IN ({placeholders}) AND a.reminder_sent = FALSE
+            """
+            return await self.backend.fetchall(query, tuple(appointment_ids))
+        except self.backend.Error as e:
+            logging.error("Erro ao buscar compromissos: %s", e)
+        return None
+
+    @_timed
+    async def get_occupied_slots(self, start_date, end_date):
+        """Compromissos (appointment_id, data, hora) entre as datas informadas, inclusive; None se houver erro de banco"""
+        try:
+            query = """
+                SELECT appointment_id, appointment_date, appointment_time
+                FROM appointments
+                WHERE appointment_date BETWEEN %s AND %s
+            """
+            return await self.backend.fetchall(query, (str(start_date), str(end_date)))
+        except self.backend.Error as e:
+            logging.error("Erro ao buscar horários ocupados: %s", e)
+        return None
+
+    @_timed
+    async def reschedule_appointment(self, telegram_id, new_date, new_time=None,
+                                     alternatives=RESCHEDULE_ALTERNATIVES, search_days=RESCHEDULE_SEARCH_DAYS):
+        """Versão assíncrona de db.reschedule_appointment (mesmo formato de retorno).
+
+        O horário pedido é confirmado pelas linhas travadas do dia (ver slot_index.slot_status);
+        as alternativas vêm de slot_index, que só consulta o banco para os dias ainda não
+        carregados ou expirados.
+        """
+        backend = self.backend
+        status = None
+        try:
+            async with backend.transaction() as transaction:
+                previous = await transaction.fetchone(RESCHEDULE_LOCK_APPOINTMENT_QUERY, (telegram_id,))
+                if previous is None:
+                    return {"status": "sem_compromisso"}
+                appointment_id, original_date, original_time, patient_id = previous
+                if new_time is None:
+                    new_time = format_time_value(original_time)
+
+                # As linhas travadas do dia confirmam o horário pedido e atualizam o dia no índice
+                day_rows = await transaction.fetchall(RESCHEDULE_LOCK_DAY_QUERY, (new_date,))
+                status = slot_status(day_rows, new_date, new_time, ignore_id=appointment_id)
+                self.slot_index.replace_days([new_date], day_rows)
+                if status == LIVRE:
+                    await transaction.execute(RESCHEDULE_MOVE_QUERY, (new_date, new_time, appointment_id))
+        except backend.IntegrityError:
+            # A restrição de horário único foi violada por uma remarcação concorrente (de outro
+            # processo, que não avisa este índice): o dia é carregado de novo
+            status = OCUPADO
+            self.slot_index.forget_days([new_date])
+        except backend.Error as e:
+            logging.error("Erro ao remarcar compromisso: %s", e)
+            return None
+
+        if status != LIVRE:
+            if not await self.slot_index.load(new_date, days=search_days):
+                return None
+            return {"status": status,
+                    "alternatives": self.slot_index.next_free_slots(new_date, new_time, count=alternatives,
+                                                                    days=search_days)}
+
+        self._notify("appointment_deleted", appointment_id)
+        self._notify("appointment_added", appointment_id, patient_id, new_date, new_time)
+        return {"status": "remarcada",
+                "appointment": (appointment_id, new_date, new_time, patient_id),
+                "previous": previous}
+
+
+# Parâmetro das consultas por intervalo na coluna appointment_at (ver migrations.py, versão 3)
+def _format_datetime(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+# Repositório compartilhado pelos handlers do bot
+repository = AsyncRepository()
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+from config import DIALOGUE_BATCH_SIZE, DIALOGUE_FLUSH_INTERVAL, DIALOGUE_BUFFER_SIZE, DIALOGUE_SPILL_PATH
+
+
+# Gravação em segundo plano (write-behind) dos diálogos
+class DialogueSink:
+    """Acumula os diálogos em memória e os grava em lote (executemany).
+
+    O lote é gravado ao atingir `batch_size` linhas ou a cada `flush_interval` segundos.
+    O buffer é limitado: quando cheio, save() aguarda (backpressure). Se o banco estiver
+    indisponível, as linhas vão para um arquivo local (JSON por linha), regravado pela tarefa
+    de fundo quando ela inicia (ver _replay_spill).
+    """
+
+    def __init__(self, write_many, batch_size=DIALOGUE_BATCH_SIZE, flush_interval=DIALOGUE_FLUSH_INTERVAL,
+                 max_buffer=DIALOGUE_BUFFER_SIZE, spill_path=DIALOGUE_SPILL_PATH):
+        # write_many recebe a lista de linhas e retorna True se gravou (ex.: repository.save_dialogues)
+        self.write_many = write_many
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spill_path = spill_path
+        self._queue = None
+        self._flush_event = None
+        self._flush_lock = None
+        self._task = None
+        self._closing = False
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+
+    async def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_buffer)
+            self._flush_event = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def save(self, telegram_id, user_message, bot_response):
+        """Enfileira o diálogo; só aguarda se o buffer estiver cheio."""
+        if self._task is None or self._task.done():
+            await self.start()
+        await self._queue.put((telegram_id, user_message, bot_response))
+        if self._queue.qsize() >= self.batch_size:
+            self._flush_event.set()
+
+    async def _run(self):
+        # O arquivo de contingência é regravado aqui, fora da resposta ao paciente
+        try:
+            await self._replay_spill()
+        except Exception as e:
+            logging.error("Erro ao reprocessar o arquivo de contingência dos diálogos: %s", e)
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # A tarefa não pode parar: sem ela o buffer enche e save() bloqueia os handlers
+                logging.error("Erro ao gravar diálogos: %s", e)
+
+    async def flush(self):
+        """Grava tudo o que está no buffer, em lotes de até `batch_size` linhas."""
+        if self._queue is None:
+            return
+        async with self._flush_lock:
+            while not self._queue.empty():
+                batch = [self._queue.get_nowait() for _ in range(min(self.batch_size, self._queue.qsize()))]
+                await self._write(batch)
+
+    async def _write(self, batch):
+        # Qualquer falha (inclusive o tempo esgotado ao pegar uma conexão do pool) desvia o lote
+        # para o arquivo de contingência em vez de perdê-lo
+        try:
+            written = await self.write_many(batch)
+        except Exception as e:
+            logging.error("Erro ao gravar %d diálogos: %r", len(batch), e)
+            written = False
+        if written:
+            self.written += len(batch)
+        else:
+            await self._spill(batch)
+
+    async def _spill(self, batch):
+        if not self.spill_path:
+            self.dropped += len(batch)
+            logging.error("%d diálogos descartados: banco indisponível e sem arquivo de contingência", len(batch))
+            return
+        try:
+            await asyncio.to_thread(self._append_spill, batch)
+        except OSError as e:
+            self.dropped += len(batch)
+            logging.error("%d diálogos descartados: erro ao gravar %s: %s", len(batch), self.spill_path, e)
+            return
+        self.spilled += len(batch)
+        logging.warning("%d diálogos gravados em %s (banco indisponível)", len(batch), self.spill_path)
+
+    def _append_spill(self, batch):
+        with open(self.spill_path, "a", encoding="utf-8") as spill:
+            for row in batch:
+                spill.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def _replay_path(self):
+        return self.spill_path + ".replay"
+
+    def _take_spill(self):
+        # As linhas em regravação ficam em .replay até serem gravadas no banco, e novas falhas
+        # continuam indo para spill_path. Um .replay que sobrou de uma execução interrompida
+        # recebe o arquivo de contingência atual e é regravado junto.
+        if not self.spill_path:
+            return []
+        replay_path = self._replay_path()
+        if os.path.exists(self.spill_path):
+            if os.path.exists(replay_path):
+                with open(self.spill_path, encoding="utf-8") as spill, open(replay_path, "a", encoding="utf-8") as replay:
+                    # Começa em uma linha nova caso a última linha do .replay tenha ficado incompleta
+                    replay.write("\n")
+                    shutil.copyfileobj(spill, replay)
+                os.remove(self.spill_path)
+            else:
+                os.replace(self.spill_path, replay_path)
+        if not os.path.exists(replay_path):
+            return []
+        rows = []
+        with open(replay_path, encoding="utf-8") as replay:
+            for line in replay:
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(tuple(json.loads(line)))
+                except ValueError:
+                    # Linha incompleta de uma gravação interrompida
+                    logging.warning("Linha inválida ignorada em %s: %r", replay_path, line[:80])
+        return rows
+
+    def _keep_replay(self, rows):
+        # Regrava no .replay só as linhas que ainda não chegaram ao banco
+        replay_path = self._replay_path()
+        with open(replay_path + ".tmp", "w", encoding="utf-8") as replay:
+            for row in rows:
+                replay.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(replay_path + ".tmp", replay_path)
+
+    async def _replay_spill(self):
+        """Grava no banco as linhas do arquivo de contingência; o .replay só é apagado depois disso.
+
+        Se o banco falhar, as linhas restantes continuam no .replay para a próxima vez que a
+        tarefa iniciar. Uma interrupção no meio pode gravar de novo os lotes já gravados.
+        """
+        rows = await asyncio.to_thread(self._take_spill)
+        if not rows:
+            return
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            try:
+                written = await self.write_many(batch)
+            except Exception as e:
+                logging.error("Erro ao gravar %d diálogos: %r", len(batch), e)
+                written = False
+            if not written:
+                await asyncio.to_thread(self._keep_replay, rows[start:])
+                logging.warning("%d diálogos continuam em %s (banco indisponível)", len(rows) - start, self._replay_path())
+                return
+            self.written += len(batch)
+        await asyncio.to_thread(os.remove, self._replay_path())
+        logging.info("%d diálogos do arquivo de contingência reprocessados", len(rows))
+
+    async def close(self):
+        """Grava o que restou no buffer e encerra a tarefa de fundo."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._flush_event.set()
+        await self._task
+        await self.flush()
+        self._task = None
+
+    def stats(self):
+        return {
+            "buffered": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import logging
+import time
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, TypeHandler
+from config import COALESCE_WINDOW, COALESCE_MAX_WAIT, COALESCE_MAX_MESSAGES
+from intent import normalize
+import metrics
+
+# Quantidade de update_id recentes guardados por chat para reconhecer reenvios do Telegram
+RECENT_UPDATE_IDS = 16
+
+
+class _ChatBuffer:
+    __slots__ = ("updates", "keys", "first_at", "timer", "in_flight", "recent_ids")
+
+    def __init__(self):
+        self.updates = []
+        self.keys = set()
+        self.first_at = None
+        self.timer = None
+        self.in_flight = False
+        self.recent_ids = collections.deque(maxlen=RECENT_UPDATE_IDS)
+
+
+class InputAggregator:
+    """Junta as mensagens seguidas de um chat em um único turno da conversa.
+
+    Cada mensagem reinicia a espera de `window` segundos (até `max_wait` desde a primeira);
+    ao fim da espera, `combine(updates)` gera um único update e `process(update)` o trata.
+    Cada chat tem no máximo um turno em andamento: o que chegar durante o turno aguarda e
+    vira o turno seguinte. Reenvios e textos repetidos no mesmo turno são descartados, e
+    acima de `max_messages` mensagens pendentes as novas são descartadas.
+    """
+
+    def __init__(self, process, combine, window=COALESCE_WINDOW, max_wait=COALESCE_MAX_WAIT,
+                 max_messages=COALESCE_MAX_MESSAGES):
+        self.process = process
+        self.combine = combine
+        self.window = window
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self._chats = {}
+        self._tasks = set()
+        # Em close(): as mensagens pendentes são tratadas sem esperar a janela
+        self._closing = False
+        self.received = 0
+        self.turns = 0
+        self.duplicates = 0
+        self.dropped = 0
+
+    def submit(self, chat_id, update_id, text, update):
+        """Adiciona a mensagem ao turno pendente do chat; retorna False se ela foi descartada."""
+        self.received += 1
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatBuffer()
+
+        # Ignora maiúsculas, acentos, pontuação e espaços ao comparar os textos
+        key = "".join(char for char in normalize(text) if char.isalnum())
+        if update_id in chat.recent_ids or key in chat.keys:
+            self.duplicates += 1
+            metrics.INPUT_MESSAGES.inc(result="duplicate")
+            return False
+        chat.recent_ids.append(update_id)
+        if len(chat.updates) >= self.max_messages:
+            self.dropped += 1
+            metrics.INPUT_MESSAGES.inc(result="dropped")
+            logging.warning("Mensagem do chat %s descartada: %d mensagens já aguardando", chat_id, len(chat.updates))
+            return False
+
+        if not chat.updates:
+            chat.first_at = time.monotonic()
+        chat.updates.append(update)
+        chat.keys.add(key)
+        metrics.INPUT_MESSAGES.inc(result="accepted")
+        self._arm(chat_id, chat)
+        return True
+
+    def _arm(self, chat_id, chat):
+        if chat.in_flight:
+            # O turno atual chama _arm de novo ao terminar
+            return
+        if chat.timer is not None:
+            chat.timer.cancel()
+            chat.timer = None
+        if self._closing:
+            # Cria o turno já, para que close() o espere
+            self._flush(chat_id)
+            return
+        if len(chat.updates) >= self.max_messages:
+            delay = 0
+        else:
+            delay = min(self.window, max(chat.first_at + self.max_wait - time.monotonic(), 0))
+        chat.timer = asyncio.get_running_loop().call_later(delay, self._flush, chat_id)
+
+    def _flush(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return
+        chat.timer = None
+        if chat.in_flight or not chat.updates:
+            return
+        updates = chat.updates
+        chat.updates = []
+        chat.keys = set()
+        chat.in_flight = True
+        self.turns += 1
+        task = asyncio.create_task(self._run(chat_id, chat, updates))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, chat_id, chat, updates):
+        try:
+            await self.process(self.combine(updates))
+        except Exception as e:
+            logging.error("Erro ao processar as mensagens do chat %s: %s", chat_id, e)
+        finally:
+            chat.in_flight = False
+            if chat.updates:
+                self._arm(chat_id, chat)
+            elif chat.timer is None:
+                # Sem nada pendente: libera a memória do chat
+                self._chats.pop(chat_id, None)
+
+    async def close(self):
+        """Trata imediatamente as mensagens pendentes e espera os turnos em andamento.
+
+        O que chegou durante um turno em andamento vira um novo turno assim que ele termina,
+        e close() também o espera.
+        """
+        self._closing = True
+        for chat_id, chat in list(self._chats.items()):
+            if chat.timer is not None:
+                chat.timer.cancel()
+            self._flush(chat_id)
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "turns": self.turns,
+            "duplicates": self.duplicates,
+            "dropped": self.dropped,
+            "pending_chats": len(self._chats),
+        }
+
+
+def combine_text_updates(updates, bot):
+    """Um único Update com os textos das mensagens, uma por linha (a última dá o restante)."""
+    if len(updates) == 1:
+        return updates[0]
+    data = updates[-1].to_dict()
+    data["message"]["text"] = "\n".join(update.message.text for update in updates)
+    # As posições das entidades (links, menções) não valem para o texto combinado
+    data["message"].pop("entities", None)
+    return Update.de_json(data, bot)
+
+
+def _is_plain_text(update):
+    message = update.message
+    return message is not None and message.text is not None and not message.text.startswith("/")
+
+
+def install(application, group=-1, **options):
+    """Intercepta as mensagens de texto antes da conversa e as entrega agrupadas por chat."""
+    released = set()
+
+    async def process(update):
+        released.add(update.update_id)
+        await application.process_update(update)
+
+    aggregator = InputAggregator(process, lambda updates: combine_text_updates(updates, application.bot), **options)
+
+    async def intercept(update, context):
+        if not isinstance(update, Update) or not _is_plain_text(update):
+            return
+        if update.update_id in released:
+            # Update já agrupado: segue para a conversa
+            released.discard(update.update_id)
+            return
+        aggregator.submit(update.effective_chat.id, update.update_id, update.message.text, update)
+        raise ApplicationHandlerStop
+
+    application.add_handler(TypeHandler(Update, intercept), group=group)
+    return aggregator
@@ -0,0 +1,155 @@
+import re
+import unicodedata
+from collections import OrderedDict, namedtuple
+from config import INTENT_CONFIDENCE_THRESHOLD, INTENT_FALLBACK_CACHE_SIZE
+
+# Intenções reconhecidas pelo bot
+CONFIRMAR = "confirmar"
+REMARCAR = "remarcar"
+CANCELAR = "cancelar"
+NAO_IDENTIFICADA = "intenção não identificada"
+
+# Padrões por intenção sobre o texto normalizado (minúsculo e sem acentos), com peso de cada um.
+# Palavras curtas e ambíguas ("sim", "ok") têm peso menor que os verbos da intenção.
+INTENT_PATTERNS = {
+    CONFIRMAR: [
+        (r"confirm\w*", 1.0),
+        (r"estarei (?:la|ai|presente)|vou comparecer|irei|vou sim|pode confirmar|combinado", 1.0),
+        (r"sim|ok|okay|certo|tudo certo|pode ser|com certeza|positivo|beleza", 0.6),
+    ],
+    REMARCAR: [
+        (r"remarc\w*|reagend\w*|adiar|adia|adie|adiamento", 1.0),
+        (r"(?:mudar|trocar|alterar) (?:a |o )?(?:data|dia|horario|hora|consulta)", 1.0),
+        (r"outr[oa] (?:dia|data|horario|hora|semana)", 0.8),
+        (r"mudar|trocar", 0.6),
+    ],
+    CANCELAR: [
+        (r"cancel\w*|desmarc\w*", 1.0),
+        (r"nao (?:vou|irei|poderei|posso|consigo) (?:mais )?(?:ir|comparecer|poder)", 1.0),
+        (r"nao posso|nao poderei|nao vou poder|nao vou mais", 0.8),
+    ],
+}
+
+# Palavras que negam o termo seguinte ("não quero cancelar")
+NEGATIONS = {"nao", "nem", "nunca", "jamais"}
+
+# Quantas palavras antes do termo são verificadas em busca de negação
+NEGATION_WINDOW = 3
+
+# Separador de orações inserido no lugar da pontuação ("não, quero cancelar" não é negação)
+_CLAUSE_BREAK = "|"
+
+_PUNCTUATION = re.compile(r"[.,;:!?\n]+")
+_NON_WORD = re.compile(r"[^\w|]+")
+
+
+# Compila todos os padrões em uma única expressão, com um grupo nomeado por padrão
+def _compile_patterns(patterns):
+    groups, weights = [], {}
+    for intent, entries in patterns.items():
+        for number, (pattern, weight) in enumerate(entries):
+            name = f"{intent}_{number}"
+            groups.append(f"(?P<{name}>{pattern})")
+            weights[name] = (intent, weight)
+    return re.compile(r"\b(?:" + "|".join(groups) + r")\b"), weights
+
+
+_MATCHER, _GROUP_WEIGHTS = _compile_patterns(INTENT_PATTERNS)
+
+# Resultado da análise: intenção, confiança (0 a 1) e se veio do modelo
+IntentResult = namedtuple("IntentResult", "intent confidence source")
+
+
+# Normaliza o texto: minúsculo, sem acentos e com a pontuação marcada como separador de orações
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = _PUNCTUATION.sub(f" {_CLAUSE_BREAK} ", text)
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def _is_negated(normalized, start):
+    previous = normalized[:start].split()[-NEGATION_WINDOW:]
+    for word in reversed(previous):
+        if word == _CLAUSE_BREAK:
+            return False
+        if word in NEGATIONS:
+            return True
+    return False
+
+
+# Classifica a mensagem apenas com os padrões (sem o modelo)
+def match_intent(text):
+    normalized = normalize(text)
+    scores = {}
+    for match in _MATCHER.finditer(normalized):
+        intent, weight = _GROUP_WEIGHTS[match.lastgroup]
+        if _is_negated(normalized, match.start()):
+            continue
+        scores[intent] = scores.get(intent, 0.0) + weight
+
+    if not scores:
+        return IntentResult(NAO_IDENTIFICADA, 0.0, "regras")
+    ranked = sorted(scores.values(), reverse=True)
+    intent = max(scores, key=scores.get)
+    best = ranked[0]
+    runner_up = ranked[1] if len(ranked) > 1 else 0.0
+    # A confiança cai com a margem sobre a segunda intenção: um empate ("não posso ir, quero
+    # remarcar") tem confiança zero e vai para o modelo em vez de seguir a ordem dos padrões
+    confidence = min(best, 1.0) * (best - runner_up) / best
+    return IntentResult(intent, confidence, "regras")
+
+
+# Resultado das regras quando o modelo não pode desempatar: um empate não escolhe nenhuma intenção
+def _without_model(result):
+    if result.confidence == 0.0:
+        return IntentResult(NAO_IDENTIFICADA, 0.0, result.source)
+    return result
+
+
+# Motor de intenções: padrões compilados com classificação pelo modelo para os casos de baixa confiança
+class IntentEngine:
+    """Classifica pelas regras e, abaixo do limiar de confiança, consulta o modelo (com cache)."""
+
+    LABELS = (CONFIRMAR, REMARCAR, CANCELAR, "outro")
+    INSTRUCTION = ("Você recebe a resposta de um paciente a um lembrete de consulta médica. "
+                   "Classifique se o paciente quer confirmar, remarcar ou cancelar a consulta.")
+
+    def __init__(self, classify_async=None, threshold=INTENT_CONFIDENCE_THRESHOLD,
+                 cache_size=INTENT_FALLBACK_CACHE_SIZE):
+        # classify_async(texto, rótulos, instrução) -> rótulo ou None (ex.: model.classify_text_async)
+        self.classify_async = classify_async
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.fallbacks = 0
+        self.fallback_hits = 0
+
+    async def analyze(self, text):
+        result = match_intent(text)
+        if result.confidence >= self.threshold:
+            return result
+        if self.classify_async is None:
+            return _without_model(result)
+
+        key = normalize(text)
+        label = self._cache.get(key)
+        if label is not None:
+            self._cache.move_to_end(key)
+            self.fallback_hits += 1
+        else:
+            self.fallbacks += 1
+            label = await self.classify_async(text, self.LABELS, self.INSTRUCTION)
+            if label is None:
+                return _without_model(result)
+            self._cache[key] = label
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        if label not in (CONFIRMAR, REMARCAR, CANCELAR):
+            return IntentResult(NAO_IDENTIFICADA, result.confidence, "modelo")
+        return IntentResult(label, max(result.confidence, self.threshold), "modelo")
+
+    def stats(self):
+        return {"fallbacks": self.fallbacks, "fallback_cache_hits": self.fallback_hits,
+                "fallback_cache_size": len(self._cache)}
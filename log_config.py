@@ -0,0 +1,145 @@
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import pytz
+from colorama import Fore, Style
+from config import LOG_LEVEL, LOG_FORMAT, LOG_BODY_MAX_CHARS, LOG_BODY_SAMPLE_RATE
+import metrics
+
+# Fuso horário de Brasília, usado no horário das mensagens
+BRAZIL_TZ = pytz.timezone("America/Sao_Paulo")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+LEVEL_COLORS = {
+    logging.ERROR: Fore.RED,
+    logging.CRITICAL: Fore.RED,
+    logging.WARNING: Fore.YELLOW,
+    logging.INFO: Fore.CYAN,
+}
+
+# Atributos padrão de um LogRecord; os demais vieram de `extra=` e vão para o JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id"}
+
+# Argumentos que podem ser formatados depois, na thread do listener, sem risco de terem mudado
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None), datetime.date, datetime.time, datetime.timedelta)
+
+
+# Texto longo (prompt ou resposta do modelo) registrado com no máximo `limit` caracteres.
+# O corte só acontece se a mensagem for de fato formatada.
+class LogBody:
+    __slots__ = ("text", "limit")
+
+    def __init__(self, text, limit=LOG_BODY_MAX_CHARS):
+        self.text = text
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.text)
+        if self.limit and len(text) > self.limit:
+            return f"{text[:self.limit]}... (+{len(text) - self.limit} caracteres)"
+        return text
+
+
+def sample_body(rate=LOG_BODY_SAMPLE_RATE):
+    """Decide se esta geração terá o prompt e a resposta registrados."""
+    return rate >= 1 or random.random() < rate
+
+
+class BrazilTimeMixin:
+    def formatTime(self, record, datefmt=None):
+        moment = datetime.datetime.fromtimestamp(record.created, BRAZIL_TZ)
+        return moment.strftime(datefmt or DATE_FORMAT)
+
+
+# Texto legível; a cor (apenas em terminais) é aplicada à linha formatada, sem alterar o registro
+class TextFormatter(BrazilTimeMixin, logging.Formatter):
+    def __init__(self, color=False):
+        super().__init__(TEXT_FORMAT, DATE_FORMAT)
+        self.color = color
+
+    def format(self, record):
+        line = super().format(record)
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id is not None:
+            line = f"{line} [trace={trace_id}]"
+        color = LEVEL_COLORS.get(record.levelno) if self.color else None
+        return f"{color}{line}{Style.RESET_ALL}" if color else line
+
+
+# Uma linha JSON por mensagem, com os campos passados em `extra=` e o trace_id do update
+class JsonFormatter(BrazilTimeMixin, logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id is not None:
+            entry["trace_id"] = trace_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Enfileira o registro sem formatá-lo: a formatação e a escrita ficam na thread do listener
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # O trace_id vive no contexto da tarefa atual e não existe na thread do listener
+        record.trace_id = metrics.current_trace()
+        if record.args and not (isinstance(record.args, tuple)
+                                and all(isinstance(arg, _IMMUTABLE_TYPES + (LogBody,)) for arg in record.args)):
+            # Objetos mutáveis podem mudar até o listener formatar; formata agora
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, stream=None):
+    """Troca os handlers do logger raiz pela fila + listener em segundo plano.
+
+    Retorna o QueueListener; chame stop_logging() ao encerrar para gravar o que restou na fila.
+    """
+    global _listener
+    stream = stream or sys.stderr
+    is_tty = hasattr(stream, "isatty") and stream.isatty()
+    if log_format == "auto":
+        log_format = "text" if is_tty else "json"
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(color=is_tty))
+
+    stop_logging()
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+    # Bibliotecas muito verbosas no nível INFO (uma linha por requisição ao Telegram)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Para o listener depois de escrever todas as mensagens já enfileiradas."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,129 @@
+import time
+from collections import OrderedDict
+from config import LOOKUP_CACHE_TTL, LOOKUP_CACHE_NEGATIVE_TTL, LOOKUP_CACHE_SIZE
+
+# Marcador de "não está no cache" (None é um resultado válido: paciente sem compromisso)
+_MISSING = object()
+
+
+# Cache de leitura (read-through) de pacientes e compromissos
+class LookupCache:
+    """Guarda as consultas por telegram_id e patient_id do repositório.
+
+    A consulta por telegram_id (JOIN de compromisso e paciente) também preenche as
+    entradas por patient_id, então uma troca de mensagens custa no máximo uma leitura.
+    As entradas expiram após `ttl` segundos (resultados vazios após `negative_ttl`) e são
+    invalidadas pelos avisos de add_appointment, delete_appointment e mark_reminder_sent.
+    Acima de `max_entries` entradas, as menos usadas são descartadas (LRU).
+    """
+
+    def __init__(self, repository, ttl=LOOKUP_CACHE_TTL, negative_ttl=LOOKUP_CACHE_NEGATIVE_TTL,
+                 max_entries=LOOKUP_CACHE_SIZE):
+        self.repository = repository
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # (tipo, chave) -> (expira_em, valor)
+        self._entries = OrderedDict()
+        # Índices reversos para invalidação (com o mesmo limite; um vínculo antigo só causa uma invalidação a mais)
+        self._telegram_by_patient = OrderedDict()
+        self._patient_by_appointment = OrderedDict()
+        self.hits = {}
+        self.misses = {}
+        repository.add_listener(self)
+
+    def _get(self, kind, key):
+        entry = self._entries.get((kind, key))
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end((kind, key))
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[(kind, key)]
+        self.misses[kind] = self.misses.get(kind, 0) + 1
+        return _MISSING
+
+    def _put(self, kind, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._entries[(kind, key)] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end((kind, key))
+        self._trim(self._entries)
+
+    def _link(self, index, key, value):
+        index[key] = value
+        index.move_to_end(key)
+        self._trim(index)
+
+    def _trim(self, entries):
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def _remember_appointment(self, telegram_id, appointment):
+        self._put("appointment_by_telegram", telegram_id, appointment)
+        if appointment is not None:
+            appointment_id, _, _, patient_id = appointment
+            self._put("patient_by_telegram", telegram_id, (patient_id,))
+            self._put("appointment_by_patient", patient_id, appointment)
+            self._link(self._telegram_by_patient, patient_id, telegram_id)
+            self._link(self._patient_by_appointment, appointment_id, patient_id)
+
+    async def get_appointment_by_telegram_id(self, telegram_id):
+        appointment = self._get("appointment_by_telegram", telegram_id)
+        if appointment is _MISSING:
+            appointment = await self.repository.get_appointment_by_telegram_id(telegram_id)
+            self._remember_appointment(telegram_id, appointment)
+        return appointment
+
+    async def get_patient_by_telegram_id(self, telegram_id):
+        patient = self._get("patient_by_telegram", telegram_id)
+        if patient is _MISSING:
+            patient = await self.repository.get_patient_by_telegram_id(telegram_id)
+            self._put("patient_by_telegram", telegram_id, patient)
+            if patient is not None:
+                self._link(self._telegram_by_patient, patient[0], telegram_id)
+        return patient
+
+    async def get_appointment_by_patient_id(self, patient_id):
+        appointment = self._get("appointment_by_patient", patient_id)
+        if appointment is _MISSING:
+            appointment = await self.repository.get_appointment_by_patient_id(patient_id)
+            self._put("appointment_by_patient", patient_id, appointment)
+            if appointment is not None:
+                self._link(self._patient_by_appointment, appointment[0], patient_id)
+        return appointment
+
+    def invalidate_patient(self, patient_id):
+        """Descarta as entradas de compromisso do paciente (a associação telegram_id -> patient_id continua válida)."""
+        self._entries.pop(("appointment_by_patient", patient_id), None)
+        telegram_id = self._telegram_by_patient.get(patient_id)
+        if telegram_id is not None:
+            self._entries.pop(("appointment_by_telegram", telegram_id), None)
+
+    def invalidate_appointment(self, appointment_id):
+        patient_id = self._patient_by_appointment.pop(appointment_id, None)
+        if patient_id is not None:
+            self.invalidate_patient(patient_id)
+
+    def clear(self):
+        self._entries.clear()
+        self._telegram_by_patient.clear()
+        self._patient_by_appointment.clear()
+
+    # Avisos do repositório
+    def appointment_added(self, appointment_id, patient_id, appointment_date, appointment_time):
+        self.invalidate_patient(patient_id)
+
+    def appointment_deleted(self, appointment_id):
+        self.invalidate_appointment(appointment_id)
+
+    def reminders_sent(self, appointment_ids):
+        for appointment_id in appointment_ids:
+            self.invalidate_appointment(appointment_id)
+
+    def stats(self):
+        kinds = set(self.hits) | set(self.misses)
+        stats = {"entries": len(self._entries)}
+        for kind in sorted(kinds):
+            hits, misses = self.hits.get(kind, 0), self.misses.get(kind, 0)
+            stats[kind] = {"hits": hits, "misses": misses, "hit_ratio": hits / (hits + misses)}
+        return stats
@@ -0,0 +1,254 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_TRACE_IDS
+
+# Limites (em segundos) dos histogramas de latência
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Limites dos histogramas de quantidade de tokens e de tokens por segundo
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# ID do update sendo processado (ver start_trace); acompanha as tarefas e chamadas assíncronas
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+trace_logger = logging.getLogger("metrics.trace")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Contador crescente, com um valor por combinação de rótulos
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_number(value)}"
+                for key, value in items]
+
+
+# Histograma com limites fixos; guarda contagem por faixa, soma e total por combinação de rótulos
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # rótulos -> [contagem por faixa..., soma, total]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Mede a duração do bloco `with`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(elapsed, **labels)
+            trace(self.name, elapsed, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labelnames))
+        return series[-1] if series else 0
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-2] + [series[-1] - sum(series[:-2])]):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+# Conjunto de métricas do processo, exportado no formato de texto do Prometheus
+class Registry:
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(self, name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(self, name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Registro compartilhado e métricas instrumentadas pelo bot
+registry = Registry()
+
+DB_QUERY_SECONDS = registry.histogram(
+    "clinicbot_db_query_seconds", "Duração das funções de acesso ao banco", ("function", "api"))
+LLM_SECONDS = registry.histogram(
+    "clinicbot_llm_seconds", "Duração total das chamadas ao modelo", ("function",))
+LLM_FIRST_TOKEN_SECONDS = registry.histogram(
+    "clinicbot_llm_first_token_seconds", "Tempo até o primeiro token gerado", ("function",))
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "clinicbot_llm_tokens_per_second", "Tokens gerados por segundo após o primeiro token", ("function",),
+    buckets=RATE_BUCKETS)
+LLM_PROMPT_TOKENS = registry.histogram(
+    "clinicbot_llm_prompt_tokens", "Tokens do prompt enviado ao modelo", ("function",), buckets=TOKEN_BUCKETS)
+INFERENCE_QUEUE_WAIT_SECONDS = registry.histogram(
+    "clinicbot_inference_queue_wait_seconds", "Tempo de espera na fila de inferência")
+DATE_PARSE_SECONDS = registry.histogram(
+    "clinicbot_date_parse_seconds", "Duração da interpretação de datas e horas")
+HANDLER_SECONDS = registry.histogram(
+    "clinicbot_handler_seconds", "Duração dos handlers do Telegram", ("handler",))
+INTENTS = registry.counter(
+    "clinicbot_intents", "Intenções identificadas", ("intent", "source"))
+REMINDERS = registry.counter(
+    "clinicbot_reminders", "Lembretes processados", ("result",))
+INPUT_MESSAGES = registry.counter(
+    "clinicbot_input_messages", "Mensagens recebidas pelo agrupador de mensagens", ("result",))
+
+
+def timed(histogram, **labels):
+    """Decorador que mede cada chamada (função comum ou coroutine) no histograma.
+
+    Com as métricas desligadas retorna a própria função, sem nenhum custo por chamada.
+    """
+    def decorator(func):
+        if not histogram.registry.enabled:
+            return func
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def start_trace(update_id):
+    """Associa as medições seguintes (nesta tarefa) ao update informado."""
+    if METRICS_TRACE_IDS:
+        _trace_id.set(update_id)
+
+
+def current_trace():
+    return _trace_id.get()
+
+
+def trace(stage, elapsed, **labels):
+    trace_id = _trace_id.get()
+    if trace_id is not None:
+        detail = " ".join(f"{name}={value}" for name, value in labels.items())
+        trace_logger.debug("trace=%s %s %s %.2fms", trace_id, stage, detail, elapsed * 1000)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve GET /metrics em uma thread separada; retorna o servidor (ou None se desligado)."""
+    if not registry.enabled or not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logging.error("Não foi possível abrir o endpoint de métricas em %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info("Métricas disponíveis em http://%s:%s/metrics", host, port)
+    return server
+
+
+# Job do job_queue que grava as métricas no log periodicamente
+async def dump_metrics(context):
+    logging.getLogger("metrics").info("Métricas:\n%s", registry.render())
@@ -0,0 +1,200 @@
+import argparse
+import sqlite3
+from config import DB_ASYNC_DRIVER, DB_SQLITE_PATH
+
+# Migrações do esquema do banco, aplicadas em ordem: (versão, descrição, {dialeto: [instruções]})
+# Uma migração aplicada não deve ser alterada; mudanças no esquema entram como uma nova versão.
+MIGRATIONS = [
+    (1, "tabelas patients, appointments e dialogues", {
+        "mysql": [
+            """
+            CREATE TABLE IF NOT EXISTS patients (
+                patient_id INT NOT NULL AUTO_INCREMENT,
+                name VARCHAR(100) NOT NULL,
+                telegram_id VARCHAR(100) NOT NULL,
+                PRIMARY KEY (patient_id)
+            ) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS appointments (
+                appointment_id INT NOT NULL AUTO_INCREMENT,
+                patient_id INT NULL,
+                appointment_date DATE NOT NULL,
+                appointment_time TIME NOT NULL,
+                reminder_sent TINYINT(1) DEFAULT '0',
+                PRIMARY KEY (appointment_id),
+                INDEX patient_id (patient_id),
+                CONSTRAINT appointments_ibfk_1 FOREIGN KEY (patient_id)
+                    REFERENCES patients (patient_id) ON DELETE CASCADE
+            ) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS dialogues (
+                dialogue_id INT NOT NULL AUTO_INCREMENT,
+                telegram_id VARCHAR(100) NOT NULL,
+                user_message TEXT NOT NULL,
+                bot_response TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (dialogue_id)
+            ) ENGINE=InnoDB DEFAULT CHARACTER SET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+            """,
+        ],
+        "sqlite": [
+            """
+            CREATE TABLE IF NOT EXISTS patients (
+                patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                telegram_id INTEGER NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS appointments (
+                appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_id INTEGER REFERENCES patients (patient_id) ON DELETE CASCADE,
+                appointment_date DATE NOT NULL,
+                appointment_time TIME NOT NULL,
+                reminder_sent BOOLEAN NOT NULL DEFAULT FALSE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS dialogues (
+                dialogue_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER NOT NULL,
+                user_message TEXT NOT NULL,
+                bot_response TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS patient_id ON appointments (patient_id)",
+        ],
+    }),
+    (2, "índices das consultas do bot e horário único", {
+        "mysql": [
+            # O bot compara telegram_id com números: em VARCHAR o MySQL converte cada linha e não usa o índice
+            "ALTER TABLE patients MODIFY telegram_id BIGINT NOT NULL",
+            "ALTER TABLE dialogues MODIFY telegram_id BIGINT NOT NULL",
+            "CREATE INDEX patients_telegram_id ON patients (telegram_id)",
+            # Também atende às buscas por data (e data/hora) e trava o horário nas remarcações
+            "CREATE UNIQUE INDEX appointments_slot ON appointments (appointment_date, appointment_time)",
+            "CREATE INDEX appointments_date_reminder ON appointments (appointment_date, reminder_sent)",
+        ],
+        "sqlite": [
+            "CREATE INDEX patients_telegram_id ON patients (telegram_id)",
+            "CREATE UNIQUE INDEX appointments_slot ON appointments (appointment_date, appointment_time)",
+            "CREATE INDEX appointments_date_reminder ON appointments (appointment_date, reminder_sent)",
+        ],
+    }),
+    (3, "coluna appointment_at (data e hora) para buscas por intervalo", {
+        "mysql": [
+            """
+            ALTER TABLE appointments
+            ADD COLUMN appointment_at DATETIME AS (TIMESTAMP(appointment_date, appointment_time)) STORED
+            """,
+            "CREATE INDEX appointments_pending_at ON appointments (reminder_sent, appointment_at)",
+        ],
+        "sqlite": [
+            # Texto "AAAA-MM-DD HH:MM:SS": a ordem alfabética é a ordem cronológica
+            """
+            ALTER TABLE appointments
+            ADD COLUMN appointment_at DATETIME GENERATED ALWAYS AS (appointment_date || ' ' || appointment_time) VIRTUAL
+            """,
+            "CREATE INDEX appointments_pending_at ON appointments (reminder_sent, appointment_at)",
+        ],
+    }),
+]
+
+VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER NOT NULL PRIMARY KEY,
+        description VARCHAR(200) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def applied_versions(connection):
+    """Versões já aplicadas no banco."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(VERSION_TABLE)
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def migrate(connection, dialect, target=None):
+    """Aplica as migrações pendentes até a versão `target` (todas se None); retorna as versões aplicadas.
+
+    `connection` é uma conexão DB-API do MySQL (mysql.connector) ou do SQLite (sqlite3).
+    No SQLite cada migração é uma transação; no MySQL as instruções DDL são confirmadas
+    uma a uma, então uma migração interrompida precisa ser corrigida à mão antes de repetir.
+    """
+    placeholder = "?" if dialect == "sqlite" else "%s"
+    if dialect == "sqlite":
+        # Controla as transações aqui: o módulo sqlite3 não abre transação para DDL
+        connection.isolation_level = None
+    done = applied_versions(connection)
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        cursor = connection.cursor()
+        try:
+            if dialect == "sqlite":
+                cursor.execute("BEGIN")
+            for statement in statements[dialect]:
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO schema_migrations (version, description) VALUES ({placeholder}, {placeholder})",
+                           (version, description))
+            if dialect == "sqlite":
+                cursor.execute("COMMIT")
+            else:
+                connection.commit()
+        except Exception:
+            if dialect == "sqlite":
+                cursor.execute("ROLLBACK")
+            else:
+                connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        applied.append(version)
+    return applied
+
+
+def connect(driver=DB_ASYNC_DRIVER, path=DB_SQLITE_PATH):
+    """Conexão síncrona com o banco configurado, para aplicar as migrações."""
+    if driver == "sqlite":
+        return sqlite3.connect(path)
+    if driver == "mysql":
+        from db import create_connection
+        return create_connection()
+    raise ValueError(f"Driver de banco desconhecido: {driver}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cria ou atualiza as tabelas do banco do bot.")
+    parser.add_argument("--driver", choices=("mysql", "sqlite"), default=DB_ASYNC_DRIVER)
+    parser.add_argument("--path", default=DB_SQLITE_PATH, help="arquivo do banco SQLite")
+    parser.add_argument("--target", type=int, help="aplica as migrações só até esta versão")
+    args = parser.parse_args()
+
+    connection = connect(args.driver, args.path)
+    if connection is None:
+        raise SystemExit(1)
+    try:
+        applied = migrate(connection, args.driver, args.target)
+    except Exception as e:
+        print(f"Erro ao aplicar as migrações: {e}")
+        raise SystemExit(1)
+    finally:
+        connection.close()
+    if applied:
+        print(f"Migrações aplicadas: {', '.join(map(str, applied))}")
+    else:
+        print("O banco já está na versão mais recente")
+
+
+if __name__ == "__main__":
+    main()
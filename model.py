@@ -1,34 +1,259 @@
+import asyncio
+import contextvars
+import functools
+import logging
 import os
-from llama_cpp import Llama
-from colorama import Fore, Style
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from llama_cpp import Llama, LlamaGrammar
+import metrics
+from log_config import LogBody, sample_body
+from config import (INFERENCE_CONCURRENCY, INFERENCE_QUEUE_SIZE,
+                    INFERENCE_TIMEOUT, INFERENCE_BUSY_MESSAGE,
+                    PREFIX_CACHE_ENABLED, PREFIX_CACHE_SIZE)
 
 # Caminho onde o modelo LLaMA será salvo localmente
 MODEL_PATH = "<Caminho para o diretório do projeto no sistema local>llama.cpp/models/llama-2-7b-chat.Q4_K_M.gguf"
 
+# Tamanho do contexto usado pelo modelo
+N_CTX = 4096
+
+# Prompt curto usado para aquecer o modelo logo após o carregamento
+WARMUP_PROMPT = "[INST] Olá [/INST]"
+
+# Instrução fixa (persona) que abre todos os prompts enviados ao modelo
+SYSTEM_PROMPT = "Você é uma secretária de um consultório médico. Responda as solicitação de forma breve e educada."
+
+
+# Lê a memória residente (RSS) do processo atual em MB
+def _resident_memory_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # ru_maxrss é o pico de memória (KB no Linux), usado quando /proc não existe
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except (ImportError, OSError):
+        return None
+
+
+# Guarda snapshots do estado do llama.cpp logo após avaliar um prefixo fixo do prompt
+class PrefixCache:
+    """LRU de estados (KV cache) por prefixo, restaurados antes de avaliar o restante do prompt."""
+
+    def __init__(self, max_snapshots=PREFIX_CACHE_SIZE):
+        self.max_snapshots = max_snapshots
+        self._states = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def restore(self, llm, prefix):
+        """Deixa o modelo com o prefixo já avaliado. Retorna True se veio de um snapshot."""
+        state = self._states.get(prefix)
+        if state is not None:
+            self._states.move_to_end(prefix)
+            llm.load_state(state)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        llm.reset()
+        llm.eval(llm.tokenize(prefix.encode("utf-8")))
+        self._states[prefix] = llm.save_state()
+        while len(self._states) > self.max_snapshots:
+            self._states.popitem(last=False)
+        return False
+
+    def clear(self):
+        self._states.clear()
+
+    def stats(self):
+        return {"snapshots": len(self._states), "hits": self.hits, "misses": self.misses}
+
+
+# Mantém uma única instância do modelo carregada em memória
+class ModelManager:
+    """Carrega o modelo LLaMA uma única vez e o reaproveita entre as respostas."""
+
+    def __init__(self, model_path=None, n_ctx=N_CTX):
+        self._model_path = model_path
+        self.n_ctx = n_ctx
+        self._llm = None
+        self._loaded_path = None
+        # O Llama não é thread-safe: carregamento e geração compartilham o mesmo lock
+        self.lock = threading.RLock()
+        self.load_time = None
+        self.warmup_time = None
+        self.resident_memory_mb = None
+        self.healthy = False
+        self.last_error = None
+        # Snapshots de prefixo pertencem ao modelo carregado e são descartados junto com ele
+        self.prefix_cache = PrefixCache()
+
+    @property
+    def model_path(self):
+        # Sem caminho explícito, segue o MODEL_PATH do módulo (permite trocar em tempo de execução)
+        return self._model_path or MODEL_PATH
+
+    @property
+    def is_loaded(self):
+        return self._llm is not None
+
+    def load(self, warmup=True):
+        """Carrega o modelo se ainda não estiver carregado ou se o MODEL_PATH mudou."""
+        with self.lock:
+            path = self.model_path
+            if self._llm is not None and self._loaded_path == path:
+                return self._llm
+
+            self._release()
+            start = time.perf_counter()
+            try:
+                llm = Llama(model_path=path, n_ctx=self.n_ctx, verbose=False)
+            except Exception as e:
+                self.healthy = False
+                self.last_error = str(e)
+                logging.error("Erro ao carregar o modelo %s: %s", path, e)
+                raise
+            self.load_time = time.perf_counter() - start
+            self._llm = llm
+            self._loaded_path = path
+
+            if warmup:
+                self._warmup(llm)
+            else:
+                self.healthy = True
+                self.last_error = None
+
+            self.resident_memory_mb = _resident_memory_mb()
+            logging.info("Modelo carregado em %.2fs (%s)", self.load_time, os.path.basename(path))
+            return llm
+
+    def _warmup(self, llm):
+        """Executa uma geração mínima para inicializar buffers e caches do llama.cpp."""
+        start = time.perf_counter()
+        try:
+            llm(WARMUP_PROMPT, max_tokens=1)
+            self.healthy = True
+            self.last_error = None
+        except Exception as e:
+            self.healthy = False
+            self.last_error = str(e)
+            logging.error("Falha no aquecimento do modelo: %s", e)
+        self.warmup_time = time.perf_counter() - start
+
+    def get(self):
+        """Retorna o modelo carregado, carregando-o sob demanda na primeira chamada."""
+        return self.load()
+
+    def reload(self, model_path=None, warmup=True):
+        """Descarta o modelo atual e carrega novamente (opcionalmente de outro caminho)."""
+        with self.lock:
+            if model_path is not None:
+                self._model_path = model_path
+            self._release()
+            return self.load(warmup=warmup)
+
+    def _release(self):
+        if self._llm is None:
+            return
+        close = getattr(self._llm, "close", None)
+        if close is not None:
+            close()
+        self._llm = None
+        self._loaded_path = None
+        self.healthy = False
+        self.prefix_cache.clear()
+
+    def status(self):
+        """Resumo do estado do modelo para monitoramento."""
+        return {
+            "model_path": self._loaded_path,
+            "loaded": self.is_loaded,
+            "healthy": self.healthy,
+            "load_time": self.load_time,
+            "warmup_time": self.warmup_time,
+            "resident_memory_mb": self.resident_memory_mb,
+            "last_error": self.last_error,
+            "prefix_cache": self.prefix_cache.stats(),
+        }
+
+
+# Instância única compartilhada pelo bot
+model_manager = ModelManager()
+
+
 # Carrega o modelo Llama
 def load_model():
-    llm = Llama(model_path=MODEL_PATH, n_ctx=4096)
-    return llm
+    return model_manager.get()
 
 
-# Gera texto a partir do modelo Llama
-def generate_text(user_prompt):
-    llm = load_model()
+# Monta o prompt e retorna (prefixo fixo, prompt completo)
+def build_prompt(user_prompt, system_prompt=SYSTEM_PROMPT):
+    prefix = f"[INST] {system_prompt} O paciente enviou a seguinte solicitação:"
+    return prefix, f"{prefix} {user_prompt}. [/INST]"
+
+
+# Executa o prompt em streaming e produz os pedaços de texto, medindo o tempo até o
+# primeiro token, os tokens por segundo e o tamanho do prompt (ver metrics.py)
+def _completion(llm, prompt, function, cancelled=None, **kwargs):
+    start = time.perf_counter()
+    first_token = None
+    tokens = 0
+    try:
+        for chunk in llm(prompt, stream=True, **kwargs):
+            # Interrompe a geração se quem consome o stream desistiu
+            if cancelled is not None and cancelled.is_set():
+                break
+            if first_token is None:
+                first_token = time.perf_counter()
+            tokens += 1
+            yield chunk['choices'][0]['text']
+    finally:
+        if metrics.registry.enabled:
+            end = time.perf_counter()
+            metrics.LLM_SECONDS.observe(end - start, function=function)
+            metrics.trace(metrics.LLM_SECONDS.name, end - start, function=function)
+            metrics.LLM_PROMPT_TOKENS.observe(len(llm.tokenize(prompt.encode("utf-8"))), function=function)
+            if first_token is not None:
+                metrics.LLM_FIRST_TOKEN_SECONDS.observe(first_token - start, function=function)
+                if tokens > 1 and end > first_token:
+                    metrics.LLM_TOKENS_PER_SECOND.observe((tokens - 1) / (end - first_token), function=function)
 
+
+# Gera texto a partir do modelo Llama
+def generate_text(user_prompt, system_prompt=SYSTEM_PROMPT):
     # Prompt simplificado
-    structured_prompt = (
-        f"[INST] Você é uma secretária de um consultório médico. Responda as solicitação de forma breve e educada. O paciente enviou a seguinte solicitação: {user_prompt}. [/INST]"
-    )
+    prefix, structured_prompt = build_prompt(user_prompt, system_prompt)
+
+    # Registra o prompt e a resposta de parte das gerações, cortados em LOG_BODY_MAX_CHARS
+    log_bodies = sample_body()
 
     try:
-        print(f"{Fore.CYAN}Prompt enviado ao modelo: {structured_prompt}{Style.RESET_ALL}")  # Log do prompt
+        if log_bodies:
+            logging.info("Prompt enviado ao modelo: %s", LogBody(structured_prompt))
 
         # Gera a resposta com um limite de tokens e tokens de parada claros
-        output = llm(structured_prompt, max_tokens=100, stop=["\n", "</s>"])
+        with model_manager.lock:
+            llm = load_model()
+            if PREFIX_CACHE_ENABLED:
+                # Restaura o prefixo já avaliado; o llama-cpp-python só avalia os tokens que faltam
+                model_manager.prefix_cache.restore(llm, prefix)
+            # Em streaming só para medir o tempo até o primeiro token; o texto é o mesmo
+            generated_text = "".join(_completion(llm, structured_prompt, "generate_text",
+                                                 max_tokens=100, stop=["\n", "</s>"]))
 
         # Captura a resposta gerada
-        generated_text = output['choices'][0]['text'].strip()
-        print(f"{Fore.GREEN}Tokens gerados: {generated_text}{Style.RESET_ALL}")  # Log da resposta
+        generated_text = generated_text.strip()
+        if log_bodies:
+            logging.info("Tokens gerados: %s", LogBody(generated_text))
 
         # Verifica se a resposta está vazia ou repetitiva
         response = generated_text if generated_text else "Desculpe, não consegui entender sua pergunta. Tente novamente."
@@ -38,3 +263,172 @@ def generate_text(user_prompt):
 
     return response
 
+
+# Gramática GBNF que restringe a saída do modelo a um dos rótulos informados
+@functools.lru_cache(maxsize=8)
+def _labels_grammar(labels):
+    return LlamaGrammar.from_string("root ::= " + " | ".join(f'"{label}"' for label in labels), verbose=False)
+
+
+# Classifica um texto em um dos rótulos, com a saída do modelo restrita por gramática
+def classify_text(text, labels, instruction):
+    prefix = f"[INST] {instruction} Responda apenas com uma das opções: {', '.join(labels)}. Mensagem:"
+    prompt = f'{prefix} "{text}" [/INST]'
+
+    try:
+        with model_manager.lock:
+            llm = load_model()
+            if PREFIX_CACHE_ENABLED:
+                model_manager.prefix_cache.restore(llm, prefix)
+            with metrics.LLM_SECONDS.time(function="classify_text"):
+                output = llm(prompt, max_tokens=8, temperature=0, grammar=_labels_grammar(tuple(labels)))
+        label = output['choices'][0]['text'].strip()
+        return label if label in labels else None
+
+    except Exception as e:
+        logging.error("Erro ao classificar texto: %s", e)
+        return None
+
+
+# Gera texto em streaming, produzindo os pedaços de texto conforme o modelo gera os tokens
+def generate_text_stream(user_prompt, system_prompt=SYSTEM_PROMPT, cancelled=None):
+    prefix, structured_prompt = build_prompt(user_prompt, system_prompt)
+
+    try:
+        if sample_body():
+            logging.info("Prompt enviado ao modelo (streaming): %s", LogBody(structured_prompt))
+
+        with model_manager.lock:
+            llm = load_model()
+            if PREFIX_CACHE_ENABLED:
+                model_manager.prefix_cache.restore(llm, prefix)
+            yield from _completion(llm, structured_prompt, "generate_text_stream", cancelled,
+                                   max_tokens=100, stop=["\n", "</s>"])
+
+    except Exception as e:
+        yield f"Desculpe, ocorreu um erro: {str(e)}"
+
+
+# Executa a inferência fora do event loop, com concorrência e fila limitadas
+class InferenceQueue:
+    """Fila limitada de gerações executadas em um executor dedicado."""
+
+    def __init__(self, concurrency=INFERENCE_CONCURRENCY, max_queue=INFERENCE_QUEUE_SIZE,
+                 timeout=INFERENCE_TIMEOUT, busy_message=INFERENCE_BUSY_MESSAGE):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.busy_message = busy_message
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llama")
+        # Contagem de pedidos aceitos (em execução + aguardando), decrementada ao terminar
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.timeouts = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def submit(self, func, *args, timeout=None):
+        """Executa func(*args) no executor; retorna a mensagem de ocupado se a fila estiver cheia."""
+        with self._lock:
+            if self._pending >= self.concurrency + self.max_queue:
+                self.rejected += 1
+                return self.busy_message
+            self._pending += 1
+
+        # Mede a espera na fila e leva o contexto (ID do update em metrics) para a thread do executor
+        queued = time.perf_counter()
+
+        def run():
+            metrics.INFERENCE_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - queued)
+            return func(*args)
+
+        future = self._executor.submit(contextvars.copy_context().run, run)
+        future.add_done_callback(self._release)
+
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # Se ainda não começou, sai da fila; se já está gerando, termina em segundo plano
+            future.cancel()
+            self.timeouts += 1
+            logging.warning("Tempo limite de geração excedido (%ss)", timeout)
+            return self.busy_message
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "pending": self._pending,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+# Fila compartilhada pelos handlers do bot
+inference_queue = InferenceQueue()
+
+
+# Versão assíncrona de generate_text, que não bloqueia o event loop
+async def generate_text_async(user_prompt, timeout=None):
+    return await inference_queue.submit(generate_text, user_prompt, timeout=timeout)
+
+
+# Versão assíncrona de classify_text; retorna None se a fila estiver cheia ou o tempo esgotar
+async def classify_text_async(text, labels, instruction, timeout=None):
+    label = await inference_queue.submit(classify_text, text, tuple(labels), instruction, timeout=timeout)
+    return label if label in labels else None
+
+
+# Marcador de fim do stream assíncrono
+_STREAM_END = object()
+
+
+# Versão assíncrona e em streaming: produz os pedaços de texto sem bloquear o event loop
+async def stream_text_async(user_prompt, system_prompt=SYSTEM_PROMPT):
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        try:
+            for piece in generate_text_stream(user_prompt, system_prompt, cancelled):
+                loop.call_soon_threadsafe(chunks.put_nowait, piece)
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, _STREAM_END)
+        return _STREAM_END
+
+    task = asyncio.ensure_future(inference_queue.submit(produce))
+    produced = False
+    try:
+        while True:
+            getter = asyncio.ensure_future(chunks.get())
+            await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                # Fila cheia ou tempo esgotado: a geração não chegou (ou não vai chegar) ao fim
+                if task.result() is not _STREAM_END:
+                    if not produced:
+                        yield task.result()
+                    return
+                # A geração terminou: consome o que ainda restou na fila
+                while (piece := await chunks.get()) is not _STREAM_END:
+                    yield piece
+                return
+            piece = getter.result()
+            if piece is _STREAM_END:
+                return
+            produced = True
+            yield piece
+    finally:
+        cancelled.set()
@@ -0,0 +1,355 @@
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+import pytz
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from config import (REMINDER_CONCURRENCY, REMINDER_GLOBAL_RATE, REMINDER_PER_CHAT_RATE,
+                    REMINDER_BATCH_SIZE, REMINDER_MAX_RETRIES, REMINDER_RETRY_BACKOFF,
+                    REMINDER_LEAD_HOURS, REMINDER_LOOKAHEAD_MINUTES, REMINDER_RESYNC_INTERVAL,
+                    REMINDER_REQUEUE_DELAY, REMINDER_REQUEUE_ATTEMPTS)
+from streaming import retry_after_seconds
+import metrics
+
+
+# Fuso horário de Brasília (GMT-3)
+BRAZIL_TZ = pytz.timezone("America/Sao_Paulo")
+
+# Resultado do envio de um lembrete: entregue, falha permanente ou falha temporária (tentar mais tarde)
+SENT = "sent"
+FAILED = "failed"
+RETRY = "retry"
+
+
+# Horário atual de Brasília sem fuso, no mesmo formato das datas gravadas no banco
+def _now():
+    return datetime.datetime.now(BRAZIL_TZ).replace(tzinfo=None)
+
+
+# Combina a data e a hora do compromisso (date/str e timedelta/time/str, conforme o driver)
+def appointment_datetime(appointment_date, appointment_time):
+    if isinstance(appointment_date, str):
+        appointment_date = datetime.date.fromisoformat(appointment_date)
+    if isinstance(appointment_time, datetime.timedelta):
+        return datetime.datetime.combine(appointment_date, datetime.time()) + appointment_time
+    if isinstance(appointment_time, str):
+        appointment_time = datetime.time.fromisoformat(appointment_time)
+    return datetime.datetime.combine(appointment_date, appointment_time)
+
+
+# Limitador token bucket: libera até `rate` envios por segundo, com rajadas de até `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Suspende o bucket (usado quando o Telegram responde 429)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Envia os lembretes com concorrência limitada, respeitando os limites do Telegram
+class ReminderDispatcher:
+    """Envia lembretes em paralelo e marca os enviados em lote no banco."""
+
+    def __init__(self, mark_sent, concurrency=REMINDER_CONCURRENCY, global_rate=REMINDER_GLOBAL_RATE,
+                 per_chat_rate=REMINDER_PER_CHAT_RATE, batch_size=REMINDER_BATCH_SIZE,
+                 max_retries=REMINDER_MAX_RETRIES, backoff=REMINDER_RETRY_BACKOFF):
+        # mark_sent recebe uma lista de appointment_id (ex.: repository.mark_reminders_sent)
+        self.mark_sent = mark_sent
+        self.concurrency = concurrency
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Envios são feitos um de cada vez; os lembretes na fila ou em envio não entram de novo
+        self._lock = asyncio.Lock()
+        self._queued = set()
+        self.last_run = None
+
+    async def _send(self, bot, chat_bucket, chat_id, text):
+        """Envia uma mensagem com novas tentativas; retorna SENT, FAILED ou RETRY."""
+        for attempt in range(self.max_retries + 1):
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return SENT
+            except RetryAfter as e:
+                # Limite global excedido: pausa todos os envios pelo tempo pedido pelo Telegram
+                self.global_bucket.pause(retry_after_seconds(e))
+            except Forbidden as e:
+                # O paciente bloqueou o bot: não adianta tentar novamente
+                logging.warning("Lembrete não entregue para %s: %s", chat_id, e)
+                return FAILED
+            except BadRequest as e:
+                # Erro permanente (ex.: chat não encontrado); BadRequest é subclasse de NetworkError
+                logging.warning("Lembrete não entregue para %s: %s", chat_id, e)
+                return FAILED
+            except NetworkError as e:
+                # TimedOut e falhas de rede: novas tentativas com espera crescente
+                if attempt == self.max_retries:
+                    logging.error("Falha ao enviar lembrete para %s: %s", chat_id, e)
+                    return RETRY
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+            except TelegramError as e:
+                logging.error("Falha ao enviar lembrete para %s: %s", chat_id, e)
+                return FAILED
+        logging.error("Lembrete para %s não enviado após %d tentativas", chat_id, self.max_retries + 1)
+        return RETRY
+
+    async def dispatch(self, bot, reminders):
+        """Envia os lembretes [(appointment_id, chat_id, texto)] e retorna as estatísticas da execução.
+
+        Uma chamada feita durante outro envio espera ele terminar; lembretes que já estão na fila
+        ou sendo enviados são ignorados. Os não entregues por falha temporária ficam em "retry_ids".
+        """
+        reminders = [reminder for reminder in reminders if reminder[0] not in self._queued]
+        ids = {reminder[0] for reminder in reminders}
+        self._queued |= ids
+        try:
+            async with self._lock:
+                return await self._dispatch(bot, reminders)
+        finally:
+            self._queued -= ids
+
+    async def _dispatch(self, bot, reminders):
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        chat_buckets = {}
+        sent_ids = []
+        stats = {"total": len(reminders), "sent": 0, "failed": 0, "retry_ids": []}
+
+        async def flush():
+            batch = sent_ids[:]
+            del sent_ids[:]
+            if batch:
+                await self.mark_sent(batch)
+
+        async def send_one(appointment_id, chat_id, text):
+            bucket = chat_buckets.setdefault(chat_id, TokenBucket(self.per_chat_rate, capacity=1))
+            async with semaphore:
+                result = await self._send(bot, bucket, chat_id, text)
+            metrics.REMINDERS.inc(result=result)
+            if result == SENT:
+                stats["sent"] += 1
+                sent_ids.append(appointment_id)
+                if len(sent_ids) >= self.batch_size:
+                    await flush()
+            elif result == RETRY:
+                stats["retry_ids"].append(appointment_id)
+            else:
+                stats["failed"] += 1
+
+        await asyncio.gather(*(send_one(*reminder) for reminder in reminders))
+        await flush()
+
+        elapsed = time.perf_counter() - start
+        stats["elapsed"] = elapsed
+        stats["throughput"] = stats["sent"] / elapsed if elapsed else 0.0
+        self.last_run = stats
+        logging.info("Lembretes: %d enviados, %d falhas, %d para tentar mais tarde em %.2fs (%.1f msg/s)",
+                     stats['sent'], stats['failed'], len(stats['retry_ids']), elapsed, stats['throughput'])
+        return stats
+
+
+# Agenda cada lembrete para o horário exato em que deve ser enviado
+class ReminderScheduler:
+    """Mantém um min-heap com os prazos dos lembretes e arma um único job para o mais próximo.
+
+    O heap é carregado por intervalos de data/hora a partir de uma marca d'água e atualizado
+    pelos avisos do repositório (add_appointment/delete_appointment). Compromissos criados
+    por outros processos são encontrados na ressincronização periódica pelo appointment_id.
+    Lembretes não entregues por falha temporária voltam ao heap com espera crescente.
+    """
+
+    def __init__(self, repository, send, lead_hours=REMINDER_LEAD_HOURS,
+                 lookahead_minutes=REMINDER_LOOKAHEAD_MINUTES, resync_interval=REMINDER_RESYNC_INTERVAL,
+                 requeue_delay=REMINDER_REQUEUE_DELAY, requeue_attempts=REMINDER_REQUEUE_ATTEMPTS):
+        # send(context, appointments) recebe as linhas de repository.get_reminders_by_ids e
+        # retorna as estatísticas de ReminderDispatcher.dispatch (com "retry_ids")
+        self.repository = repository
+        self.send = send
+        self.lead = datetime.timedelta(hours=lead_hours)
+        self.lookahead = datetime.timedelta(minutes=lookahead_minutes)
+        self.resync_interval = resync_interval
+        self.requeue_delay = requeue_delay
+        self.requeue_attempts = requeue_attempts
+        self._heap = []
+        # appointment_id -> prazo vigente; entradas do heap sem correspondência aqui são ignoradas
+        self._deadlines = {}
+        # appointment_id -> horário da consulta, até o lembrete ser entregue ou descartado
+        self._starts = {}
+        # appointment_id -> envios que falharam temporariamente
+        self._attempts = {}
+        self._time_watermark = None
+        self._id_watermark = 0
+        self._job_queue = None
+        self._job = None
+        self._armed_at = None
+
+    def start(self, job_queue, first=0):
+        """Agenda a carga inicial e as ressincronizações periódicas.
+
+        Só então passa a ouvir o repositório: nos processos que não enviam lembretes (ver
+        webhook.py) os avisos apenas acumulariam prazos que nunca seriam disparados.
+        """
+        self._job_queue = job_queue
+        self.repository.add_listener(self)
+        job_queue.run_repeating(self._resync_job, interval=self.resync_interval, first=first)
+
+    async def _resync_job(self, context):
+        await self.resync()
+
+    async def resync(self):
+        """Carrega os prazos que entraram na janela desde a última marca d'água."""
+        now = _now()
+        horizon = now + self.lead + self.lookahead
+        start = self._time_watermark or now
+
+        rows = list(await self.repository.get_reminder_deadlines(start, horizon))
+        if self._time_watermark is not None:
+            # Compromissos criados fora deste processo dentro da janela já carregada
+            rows += await self.repository.get_reminder_deadlines_after_id(self._id_watermark, now, start)
+
+        for appointment_id, appointment_date, appointment_time in rows:
+            self.schedule(appointment_id, appointment_date, appointment_time)
+            self._id_watermark = max(self._id_watermark, appointment_id)
+        self._time_watermark = horizon
+        logging.info("Lembretes agendados: %d (carregados %d até %s)", len(self._deadlines), len(rows), horizon)
+
+    def schedule(self, appointment_id, appointment_date, appointment_time):
+        """Agenda (ou reagenda) o lembrete de um compromisso."""
+        now = _now()
+        at = appointment_datetime(appointment_date, appointment_time)
+        if at <= now or (self._time_watermark is not None and at > self._time_watermark):
+            # Já passou, ou será carregado quando a janela alcançar o compromisso
+            self._forget(appointment_id)
+            return
+        # Compromissos a menos de 24 horas recebem o lembrete imediatamente
+        fire_at = max(at - self.lead, now)
+        self._attempts.pop(appointment_id, None)
+        self._push(appointment_id, fire_at, at)
+
+    def _push(self, appointment_id, fire_at, at):
+        self._deadlines[appointment_id] = fire_at
+        self._starts[appointment_id] = at
+        heapq.heappush(self._heap, (fire_at, appointment_id))
+        self._arm()
+
+    def _forget(self, appointment_id):
+        self._deadlines.pop(appointment_id, None)
+        self._starts.pop(appointment_id, None)
+        self._attempts.pop(appointment_id, None)
+
+    def _finish(self, appointment_id):
+        # Um prazo novo significa que o compromisso foi remarcado durante o envio: mantém o agendamento
+        if appointment_id not in self._deadlines:
+            self._forget(appointment_id)
+
+    def cancel(self, appointment_id):
+        # Remoção preguiçosa: a entrada do heap é descartada quando chegar ao topo
+        self._forget(appointment_id)
+
+    def _requeue(self, appointment_id):
+        """Agenda nova tentativa de um lembrete não entregue, com espera dobrada a cada falha."""
+        at = self._starts.get(appointment_id)
+        if at is None or appointment_id in self._deadlines:
+            # Compromisso removido ou remarcado durante o envio
+            return
+        attempts = self._attempts.get(appointment_id, 0) + 1
+        fire_at = _now() + datetime.timedelta(seconds=self.requeue_delay * 2 ** (attempts - 1))
+        if attempts > self.requeue_attempts or fire_at >= at:
+            logging.error("Lembrete do compromisso %s descartado após %d tentativas", appointment_id, attempts)
+            self._forget(appointment_id)
+            return
+        self._attempts[appointment_id] = attempts
+        self._push(appointment_id, fire_at, at)
+
+    # Avisos do repositório
+    def appointment_added(self, appointment_id, patient_id, appointment_date, appointment_time):
+        if appointment_id is not None:
+            self.schedule(appointment_id, appointment_date, appointment_time)
+
+    def appointment_deleted(self, appointment_id):
+        self.cancel(appointment_id)
+
+    def _discard_stale(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _arm(self):
+        """Arma um job run_once para o prazo mais próximo do heap."""
+        if self._job_queue is None:
+            return
+        self._discard_stale()
+        if not self._heap:
+            return
+        head = self._heap[0][0]
+        if self._armed_at is not None and self._armed_at <= head:
+            return
+        if self._job is not None:
+            self._job.schedule_removal()
+        delay = max((head - _now()).total_seconds(), 0)
+        self._job = self._job_queue.run_once(self._fire, when=delay)
+        self._armed_at = head
+
+    async def _fire(self, context):
+        self._job = None
+        self._armed_at = None
+        now = _now()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, appointment_id = heapq.heappop(self._heap)
+            if self._deadlines.get(appointment_id) == fire_at:
+                del self._deadlines[appointment_id]
+                due.append(appointment_id)
+        # Se algo falhar antes do fim do envio, todos voltam ao heap
+        retry = due
+        try:
+            if due:
+                appointments = await self.repository.get_reminders_by_ids(due)
+                if appointments is not None:
+                    fetched = [row[0] for row in appointments]
+                    # Os que não vieram já receberam lembrete ou foram removidos
+                    for appointment_id in set(due) - set(fetched):
+                        self._finish(appointment_id)
+                    retry = fetched
+                    stats = await self.send(context, appointments) if appointments else None
+                    retry = stats["retry_ids"] if stats else []
+                    for appointment_id in set(fetched) - set(retry):
+                        self._finish(appointment_id)
+        finally:
+            for appointment_id in retry:
+                self._requeue(appointment_id)
+            self._arm()
+
+    def stats(self):
+        return {
+            "scheduled": len(self._deadlines),
+            "heap_size": len(self._heap),
+            "retrying": len(self._attempts),
+            "next_deadline": self._armed_at,
+            "time_watermark": self._time_watermark,
+            "id_watermark": self._id_watermark,
+        }
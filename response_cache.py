@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import (RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_VARIANTS,
+                    INFERENCE_BUSY_MESSAGE)
+
+# Prompts fixos enviados ao modelo. Os campos entre chaves são preenchidos em cada chamada.
+CANNED_PROMPTS = {
+    "confirmar": "O paciente confirmou que virá à consulta, nao diga nada antes da resposta, apenas diga que entendeu e a consulta esta confirmada, nada mais.",
+    "cancelar": "O paciente cancelou a consulta. Marcar como cancelada e encerrar a conversa.",
+    "remarcar": "O paciente deseja remarcar. Perguntar apenas para qual data remarcar.",
+    "nao_identificada": "A intenção do paciente não foi identificada, peça mais detalhes.",
+    "remarcada": "Consulta remarcada para {new_date} às {new_time}. Agradecer e encerrar a conversa",
+    "horario_ocupado": "O horário solicitado está ocupado. Os próximos horários disponíveis são: {next_times}. Gostaria de marcar para algum desses horários?",
+    "fora_do_expediente": "O horário solicitado está fora do horário de atendimento. Os próximos horários disponíveis são: {next_times}. Gostaria de marcar para algum desses horários?",
+    "sem_horarios": "Não há horários disponíveis para a data {new_date}. Por favor, escolha outra.",
+}
+
+# Valores de exemplo usados para pré-calcular os prompts com campos
+SAMPLE_SLOTS = {
+    "new_date": "2099-12-25",
+    "new_time": "09:41:00",
+    "next_times": "25/12/2099 às 09:41, 25/12/2099 às 10:41",
+}
+
+
+# Verifica se a resposta do modelo pode ser guardada (não guarda erros nem a mensagem de fila cheia)
+def _is_cacheable(text):
+    return bool(text) and text != INFERENCE_BUSY_MESSAGE and not text.startswith("Desculpe")
+
+
+# Converte uma resposta gerada em um modelo com campos, trocando os valores usados pelos nomes dos campos
+def _to_template(text, slots):
+    template = text.replace("{", "{{").replace("}", "}}")
+    for name, value in slots.items():
+        value = str(value)
+        if value not in template:
+            return None
+        template = template.replace(value, "{" + name + "}")
+    return template
+
+
+# Cache de respostas com expulsão LRU/TTL e rodízio entre variantes
+class ResponseCache:
+    """Guarda até N variantes de resposta por prompt fixo e alterna entre elas."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 variants=RESPONSE_CACHE_VARIANTS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = variants
+        # chave -> [instante de criação, lista de variantes, índice do rodízio]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        """Retorna a próxima variante guardada, ou None enquanto ainda faltam variantes."""
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None or len(entry[1]) < self.variants:
+                self.misses += 1
+                return None
+            self.hits += 1
+            variant = entry[1][entry[2] % len(entry[1])]
+            entry[2] += 1
+            return variant
+
+    def put(self, key, variant):
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                entry = [time.monotonic(), [], 0]
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            if variant not in entry[1] and len(entry[1]) < self.variants:
+                entry[1].append(variant)
+
+    def variant_count(self, key):
+        with self._lock:
+            entry = self._live_entry(key)
+            return len(entry[1]) if entry is not None else 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+# Respostas para os prompts fixos do bot, servidas pelo cache sempre que possível
+class CannedResponses:
+    def __init__(self, cache=None, prompts=CANNED_PROMPTS):
+        self.cache = cache or ResponseCache()
+        self.prompts = prompts
+
+    def _remember(self, name, response, slots):
+        if not _is_cacheable(response):
+            return
+        template = _to_template(response, slots)
+        if template is not None:
+            self.cache.put(name, template)
+
+    async def get(self, name, generate_async, **slots):
+        """Retorna a resposta para o prompt `name`, gerando com o modelo apenas em caso de falta."""
+        template = self.cache.get(name)
+        if template is not None:
+            return template.format(**slots)
+
+        response = await generate_async(self.prompts[name].format(**slots))
+        self._remember(name, response, slots)
+        return response
+
+    def precompute(self, generate, variants=None):
+        """Gera as variantes de todos os prompts fixos (usado na inicialização do bot)."""
+        variants = variants or self.cache.variants
+        for name, prompt in self.prompts.items():
+            slots = {slot: value for slot, value in SAMPLE_SLOTS.items() if "{" + slot + "}" in prompt}
+            # Algumas tentativas a mais, pois respostas repetidas ou sem os campos são descartadas
+            for _ in range(variants * 2):
+                self._remember(name, generate(prompt.format(**slots)), slots)
+                if self.cache.variant_count(name) >= variants:
+                    break
+        logging.info("Respostas pré-calculadas: %s", self.cache.stats())
+
+
+# Instância compartilhada pelo bot
+canned_responses = CannedResponses()
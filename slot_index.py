@@ -0,0 +1,178 @@
+import datetime
+import time
+from config import SLOT_MINUTES, WORKING_HOURS, SLOT_INDEX_TTL
+
+# Situação de um horário pedido (ver slot_status)
+LIVRE = "livre"
+OCUPADO = "ocupado"
+FORA_DO_EXPEDIENTE = "fora_do_expediente"
+
+
+# Converte um horário (timedelta do MySQL, datetime.time ou "HH:MM[:SS]") em minutos desde a meia-noite
+def to_minutes(value):
+    if isinstance(value, datetime.timedelta):
+        return int(value.total_seconds()) // 60
+    if isinstance(value, str):
+        value = datetime.time.fromisoformat(value)
+    return value.hour * 60 + value.minute
+
+
+# Converte uma data (datetime.date ou "YYYY-MM-DD") em datetime.date
+def to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return value
+
+
+# Índice em memória dos horários ocupados, com um bitmap por dia
+class SlotIndex:
+    """Responde "horário livre?" e "próximos horários livres" sem consultar o banco.
+
+    Cada dia é um inteiro em que o bit i indica que o slot i (i * slot_minutes desde a
+    meia-noite) está ocupado. Os dias são carregados do repositório sob demanda, expiram
+    após `ttl` segundos e são atualizados pelos avisos de add_appointment/delete_appointment.
+    Sem `repository`, os dias são preenchidos só por replace_days.
+    """
+
+    def __init__(self, repository=None, slot_minutes=SLOT_MINUTES, working_hours=WORKING_HOURS, ttl=SLOT_INDEX_TTL):
+        self.repository = repository
+        self.slot_minutes = slot_minutes
+        self.ttl = ttl
+        # Máscara de slots de atendimento por dia da semana (0 = segunda-feira)
+        self._working_masks = {weekday: self._build_mask(intervals)
+                               for weekday, intervals in working_hours.items()}
+        self._occupied = {}
+        self._loaded_at = {}
+        # appointment_id -> (data, slot), para desfazer a ocupação quando o compromisso é apagado
+        self._by_id = {}
+        if repository is not None:
+            repository.add_listener(self)
+
+    def _build_mask(self, intervals):
+        mask = 0
+        for start, end in intervals or ():
+            for slot in range(to_minutes(start) // self.slot_minutes, to_minutes(end) // self.slot_minutes):
+                mask |= 1 << slot
+        return mask
+
+    def _slot(self, value):
+        return to_minutes(value) // self.slot_minutes
+
+    def _slot_time(self, slot):
+        minutes = slot * self.slot_minutes
+        return datetime.time(minutes // 60, minutes % 60)
+
+    def _is_fresh(self, day):
+        loaded_at = self._loaded_at.get(day)
+        return loaded_at is not None and time.monotonic() - loaded_at <= self.ttl
+
+    async def load(self, start_date, days=1):
+        """Carrega (em uma única consulta) os dias ainda não carregados ou expirados.
+
+        Retorna False se a consulta falhar (os dias continuam sem carregar).
+        """
+        start_date = to_date(start_date)
+        wanted = [start_date + datetime.timedelta(days=offset) for offset in range(days)]
+        stale = [day for day in wanted if not self._is_fresh(day)]
+        if not stale:
+            return True
+        # Descarta os dias expirados que não foram pedidos, para o índice não crescer sem limite
+        self.forget_days([day for day in self._occupied if day not in wanted and not self._is_fresh(day)])
+        rows = await self.repository.get_occupied_slots(stale[0], stale[-1])
+        if rows is None:
+            return False
+        self.replace_days(stale, rows)
+        return True
+
+    def replace_days(self, days, rows):
+        """Substitui a ocupação dos dias informados pelas linhas (appointment_id, data, hora)."""
+        days = {to_date(day) for day in days}
+        now = time.monotonic()
+        self.forget_days(days)
+        for day in days:
+            self._occupied[day] = 0
+            self._loaded_at[day] = now
+        for appointment_id, appointment_date, appointment_time in rows:
+            day = to_date(appointment_date)
+            if day in days:
+                self._occupy(appointment_id, day, self._slot(appointment_time))
+
+    def forget_days(self, days):
+        """Remove os dias informados do índice; serão carregados de novo no próximo load."""
+        days = {to_date(day) for day in days}
+        for day in days:
+            self._occupied.pop(day, None)
+            self._loaded_at.pop(day, None)
+        self._by_id = {appointment_id: entry for appointment_id, entry in self._by_id.items()
+                       if entry[0] not in days}
+
+    def _occupy(self, appointment_id, day, slot):
+        self._occupied[day] = self._occupied.get(day, 0) | (1 << slot)
+        self._by_id[appointment_id] = (day, slot)
+
+    # Avisos do repositório
+    def appointment_added(self, appointment_id, patient_id, appointment_date, appointment_time):
+        day = to_date(appointment_date)
+        if day in self._occupied:
+            self._occupy(appointment_id, day, self._slot(appointment_time))
+
+    def appointment_deleted(self, appointment_id):
+        entry = self._by_id.pop(appointment_id, None)
+        if entry is not None and entry[0] in self._occupied:
+            day, slot = entry
+            self._occupied[day] &= ~(1 << slot)
+
+    def _free_mask(self, day):
+        return self._working_masks.get(day.weekday(), 0) & ~self._occupied.get(day, 0)
+
+    def is_working_time(self, date, time_value):
+        """Indica se o horário está dentro do expediente do dia."""
+        return bool(self._working_masks.get(to_date(date).weekday(), 0) >> self._slot(time_value) & 1)
+
+    def is_free(self, date, time_value):
+        """Indica se o horário está dentro do expediente e não está ocupado (o dia deve estar carregado)."""
+        day = to_date(date)
+        return bool(self._free_mask(day) >> self._slot(time_value) & 1)
+
+    def next_free_slots(self, date, time_value=None, count=1, days=1):
+        """Retorna até `count` horários livres [(data, hora)] a partir de date/time_value, nos próximos `days` dias."""
+        start_day = to_date(date)
+        slot = self._slot(time_value) if time_value is not None else 0
+        found = []
+        for offset in range(days):
+            day = start_day + datetime.timedelta(days=offset)
+            free = self._free_mask(day) >> slot << slot
+            while free and len(found) < count:
+                lowest = free & -free
+                found.append((day, self._slot_time(lowest.bit_length() - 1)))
+                free ^= lowest
+            if len(found) >= count:
+                break
+            slot = 0
+        return found
+
+    def next_free_slot(self, date, time_value=None, days=1):
+        """Próximo horário livre no dia (ou nos próximos `days` dias), ou None."""
+        slots = self.next_free_slots(date, time_value, count=1, days=days)
+        return slots[0] if slots else None
+
+
+# Próximos horários livres calculados a partir de linhas (appointment_id, data, hora) já consultadas
+def free_slots(rows, date, time_value=None, count=1, days=1):
+    start_day = to_date(date)
+    index = SlotIndex()
+    index.replace_days([start_day + datetime.timedelta(days=offset) for offset in range(days)], rows)
+    return index.next_free_slots(start_day, time_value, count=count, days=days)
+
+
+# Situação do horário pedido a partir das linhas (appointment_id, data, hora) do dia;
+# `ignore_id` é o compromisso que está sendo movido, que não ocupa o próprio horário
+def slot_status(rows, date, time_value, ignore_id=None):
+    day = to_date(date)
+    index = SlotIndex()
+    index.replace_days([day], [row for row in rows if row[0] != ignore_id])
+    if not index.is_working_time(day, time_value):
+        return FORA_DO_EXPEDIENTE
+    return LIVRE if index.is_free(day, time_value) else OCUPADO
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+from telegram.constants import ChatAction
+from telegram.error import BadRequest, RetryAfter
+from config import STREAM_EDIT_INTERVAL, STREAM_PLACEHOLDER
+
+# Resposta usada quando o modelo não gera nenhum texto
+EMPTY_RESPONSE = "Desculpe, não consegui entender sua pergunta. Tente novamente."
+
+# Intervalo (em segundos) para renovar o indicador "digitando..." (o Telegram o mostra por ~5s)
+TYPING_REFRESH_INTERVAL = 4
+
+
+# Converte o retry_after do Telegram (int ou timedelta, conforme a versão) em segundos
+def retry_after_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+# Mantém o indicador "digitando..." ativo até ser cancelado
+async def _keep_typing(bot, chat_id):
+    while True:
+        try:
+            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+        except Exception as e:
+            logging.warning("Falha ao enviar indicador de digitação: %s", e)
+        await asyncio.sleep(TYPING_REFRESH_INTERVAL)
+
+
+# Envia a resposta em streaming: um placeholder editado aos poucos conforme os tokens chegam
+async def stream_reply(message, bot, chunks, reply_markup=None, edit_interval=STREAM_EDIT_INTERVAL):
+    """Edita a mensagem no máximo uma vez a cada `edit_interval` segundos e retorna o texto final."""
+    placeholder = await message.reply_text(STREAM_PLACEHOLDER, reply_markup=reply_markup)
+    typing = asyncio.create_task(_keep_typing(bot, message.chat_id))
+
+    text = ""
+    shown = STREAM_PLACEHOLDER
+    # O primeiro pedaço de texto é mostrado assim que chega
+    next_edit = time.monotonic()
+
+    async def edit(new_text):
+        nonlocal shown, next_edit
+        if not new_text or new_text == shown:
+            return
+        try:
+            await placeholder.edit_text(new_text)
+            shown = new_text
+        except RetryAfter as e:
+            # Respeita o limite de edições do chat e adia a próxima atualização
+            next_edit = time.monotonic() + retry_after_seconds(e)
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+            shown = new_text
+        next_edit = time.monotonic() + edit_interval
+
+    try:
+        async for piece in chunks:
+            if not typing.done():
+                typing.cancel()
+            text += piece
+            if time.monotonic() >= next_edit:
+                await edit(text.strip())
+    finally:
+        typing.cancel()
+
+    text = text.strip() or EMPTY_RESPONSE
+    # A edição final sempre é enviada, aguardando o intervalo mínimo entre edições
+    while shown != text:
+        await asyncio.sleep(max(next_edit - time.monotonic(), 0))
+        await edit(text)
+    return text
@@ -0,0 +1,239 @@
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import (TELEGRAM_TOKEN, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL,
+                    WEBHOOK_SECRET_TOKEN, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, METRICS_PORT)
+
+# Processo responsável pelos lembretes (e pela cópia periódica das métricas)
+JOB_OWNER = 0
+
+# Tempo (em segundos) para os processos terminarem o que estão fazendo ao encerrar
+SHUTDOWN_TIMEOUT = 30
+
+# Intervalo (em segundos) com que um processo ocioso verifica se o servidor ainda existe
+PARENT_CHECK_INTERVAL = 1
+
+
+def update_chat_id(update):
+    """chat_id de um update (dict do JSON do Telegram), ou None se não houver chat."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        sender = value.get("from")
+        if sender:
+            return sender["id"]
+    return None
+
+
+def worker_for(chat_id, workers):
+    """Processo que atende o chat; updates sem chat vão para o dono dos jobs."""
+    if chat_id is None:
+        return JOB_OWNER
+    return chat_id % workers
+
+
+# Recebe os POSTs do Telegram e repassa cada update para a fila do processo do chat
+class _WebhookHandler(BaseHTTPRequestHandler):
+    router = None
+
+    def do_POST(self):
+        if self.path.split("?")[0] != WEBHOOK_PATH:
+            self.send_error(404)
+            return
+        if WEBHOOK_SECRET_TOKEN is not None:
+            received = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(received, WEBHOOK_SECRET_TOKEN):
+                self.send_error(403)
+                return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            update = json.loads(body)
+            chat_id = update_chat_id(update)
+        except (ValueError, AttributeError, KeyError, TypeError):
+            self.send_error(400)
+            return
+
+        if not self.router.route(chat_id, body):
+            # O Telegram reenvia o update mais tarde
+            self.send_error(503)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Router:
+    """Filas de updates (um processo por fila) e contagem por processo."""
+
+    def __init__(self, queues):
+        self.queues = queues
+        self.routed = [0] * len(queues)
+        self.rejected = 0
+
+    def route(self, chat_id, body):
+        index = worker_for(chat_id, len(self.queues))
+        try:
+            self.queues[index].put_nowait(body)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.routed[index] += 1
+        return True
+
+
+# Repassa ao dono dos lembretes os compromissos criados/removidos neste processo, para que o
+# ReminderScheduler de lá fique atualizado (ver AsyncRepository.add_listener)
+class _EventForwarder:
+    def __init__(self, events):
+        self.events = events
+
+    def appointment_added(self, appointment_id, patient_id, appointment_date, appointment_time):
+        self.events.put(("appointment_added", (appointment_id, patient_id, appointment_date, appointment_time)))
+
+    def appointment_deleted(self, appointment_id):
+        self.events.put(("appointment_deleted", (appointment_id,)))
+
+
+async def _apply_events(events, scheduler):
+    loop = asyncio.get_running_loop()
+    while (event := await loop.run_in_executor(None, events.get)) is not None:
+        name, args = event
+        getattr(scheduler, name)(*args)
+
+
+# Próximo update da fila; None ao encerrar ou se o servidor tiver morrido sem enviar o aviso
+def _next_update(updates):
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            return updates.get(timeout=PARENT_CHECK_INTERVAL)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                logging.warning("Servidor do webhook encerrado; finalizando o processo")
+                return None
+
+
+async def _run_worker(index, updates, events):
+    import bot
+    import metrics
+    from telegram import Update
+
+    # Cada processo tem o seu arquivo de contingência dos diálogos
+    if bot.dialogue_sink.spill_path:
+        bot.dialogue_sink.spill_path = f"{bot.dialogue_sink.spill_path}.{index}"
+    if METRICS_PORT:
+        metrics.start_http_server(port=METRICS_PORT + index)
+
+    application = bot.build_application(updater=False)
+    owner = index == JOB_OWNER
+    if owner:
+        bot.start_jobs(application)
+        event_task = asyncio.create_task(_apply_events(events, bot.reminder_scheduler))
+    else:
+        bot.repository.add_listener(_EventForwarder(events))
+
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    await application.start()
+    logging.info("Processo %d pronto%s", index, " (lembretes)" if owner else "")
+    try:
+        while (body := await loop.run_in_executor(None, _next_update, updates)) is not None:
+            try:
+                update = Update.de_json(json.loads(body), application.bot)
+            except (ValueError, KeyError, TypeError) as e:
+                logging.error("Update inválido descartado: %s", e)
+                continue
+            await application.update_queue.put(update)
+    finally:
+        await application.stop()
+        # O post_stop e o post_shutdown só são chamados pelo run_polling/run_webhook
+        await bot.flush_pending_input(application)
+        if owner:
+            # Libera a leitura dos eventos caso o encerramento não tenha vindo do servidor
+            events.put(None)
+            await event_task
+        await bot.close_resources(application)
+        await application.shutdown()
+        bot.inference_queue.shutdown()
+
+
+def _worker_main(index, updates, events):
+    # Ctrl+C, systemctl stop e docker stop chegam a todos os processos do grupo; quem encerra os
+    # processos é o servidor (ver serve), depois que cada um gravou diálogos e estado das conversas
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    import log_config
+    import bot
+    log_config.setup_logging()
+    try:
+        bot.prepare_model()
+        asyncio.run(_run_worker(index, updates, events))
+    finally:
+        log_config.stop_logging()
+
+
+async def _register_webhook():
+    from telegram import Bot
+
+    async with Bot(TELEGRAM_TOKEN) as telegram_bot:
+        await telegram_bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET_TOKEN)
+    logging.info("Webhook registrado em %s", WEBHOOK_URL)
+
+
+def serve(workers=WEBHOOK_WORKERS, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT):
+    """Inicia os processos do bot e o servidor HTTP que distribui os updates por chat_id.
+
+    Bloqueia até SIGINT/SIGTERM; então para de aceitar updates, espera cada processo
+    terminar os que já recebeu e encerra.
+    """
+    context = multiprocessing.get_context("spawn")
+    updates = [context.Queue(WEBHOOK_QUEUE_SIZE) for _ in range(workers)]
+    events = context.Queue()
+    processes = [context.Process(target=_worker_main, args=(index, updates[index], events),
+                                 name=f"bot-worker-{index}", daemon=False)
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+
+    if WEBHOOK_URL:
+        asyncio.run(_register_webhook())
+
+    router = Router(updates)
+    handler = type("WebhookHandler", (_WebhookHandler,), {"router": router})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    def stop(signum, frame):
+        # shutdown() espera o serve_forever terminar; chamado de outra thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    logging.info("Recebendo updates em http://%s:%s%s com %d processos", host, port, WEBHOOK_PATH, workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info("Encerrando: updates por processo %s, %d recusados", router.routed, router.rejected)
+        for worker_updates in updates:
+            worker_updates.put(None)
+        events.put(None)
+        for process in processes:
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logging.warning("Processo %s não terminou a tempo e foi interrompido", process.name)
+                process.terminate()